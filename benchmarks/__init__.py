@@ -0,0 +1 @@
+"""Бенчмарки и поддельные внешние сервисы для них."""
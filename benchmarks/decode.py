@@ -0,0 +1,105 @@
+"""Микробенчмарк разбора ответов hh.ru: стоимость одного резюме до и после быстрого пути.
+
+«До» — stdlib json и dateutil, как раньше; «после» — `bot.decoding` с каждой установленной
+библиотекой JSON. Ответы записаны в benchmarks/samples.
+
+    python -m benchmarks.decode --number 2000
+"""
+from typing import Any, Callable, Dict, List
+import os
+import sys
+import json
+import timeit
+import argparse
+import dateutil.parser
+import bot.decoding
+from bot.hh_api import HeadHunterAPI, resume_fields
+from bot.models import HeadHunterResume
+
+samples_dir = os.path.join(os.path.dirname(__file__), 'samples')
+
+
+def load_sample(name: str) -> bytes:
+    with open(os.path.join(samples_dir, name), 'rb') as f:
+        return f.read()
+
+
+def decode_resume_before(body: bytes) -> HeadHunterResume:
+    data = json.loads(body)
+    return HeadHunterResume(
+        resume_id=data['id'],
+        title=data['title'],
+        status=data['status']['id'],
+        access=data['access']['type']['id'],
+        next_publish_at=dateutil.parser.parse(data['next_publish_at'])
+    )
+
+
+def decode_list_before(body: bytes) -> List[HeadHunterResume]:
+    data = json.loads(body)
+    return [
+        HeadHunterResume(
+            resume_id=item['id'],
+            title=item['title'],
+            status=item['status']['id'],
+            access=item['access']['type']['id'],
+            next_publish_at=dateutil.parser.parse(item['next_publish_at'])
+        )
+        for item in data['items']
+    ]
+
+
+def after(loads: Callable[[bytes], Any]) -> Dict[str, Callable[[bytes], Any]]:
+    """Разбор ресурса и списка так же, как это делает HeadHunterAPI, с указанной библиотекой JSON."""
+    def decode_resume(body: bytes) -> HeadHunterResume:
+        return HeadHunterAPI._resume_from_data(loads(body))
+
+    def decode_list(body: bytes) -> List[HeadHunterResume]:
+        items = [{field: item.get(field) for field in resume_fields} for item in loads(body)['items']]
+        return [HeadHunterAPI._resume_from_data(item) for item in items]
+
+    return {'resume': decode_resume, 'list': decode_list}
+
+
+def measure(decode: Callable[[bytes], Any], body: bytes, resumes: int, number: int) -> float:
+    """Лучшее из пяти повторов время разбора одного резюме в микросекундах."""
+    best = min(timeit.repeat(lambda: decode(body), number=number, repeat=5))
+    return best / number / resumes * 10 ** 6
+
+
+def main(args) -> None:
+    resume_body = load_sample('resume.json')
+    list_body = load_sample('resumes_mine.json')
+    list_size = len(json.loads(list_body)['items'])
+
+    variants: Dict[str, Dict[str, Callable[[bytes], Any]]] = {
+        'before (json + dateutil)': {'resume': decode_resume_before, 'list': decode_list_before},
+    }
+    for name, loads in bot.decoding.json_backends.items():
+        variants[f'after ({name} + fixed format)'] = after(loads)
+
+    # every variant must produce the same resumes
+    expected = [r.as_dict() for r in decode_list_before(list_body)]
+    for decode in variants.values():
+        assert [r.as_dict() for r in decode['list'](list_body)] == expected
+
+    print(f'{"":40} {"/resumes/{id}":>16} {"/resumes/mine":>16}')
+    for name, decode in variants.items():
+        resume_cost = measure(decode['resume'], resume_body, 1, args.number)
+        list_cost = measure(decode['list'], list_body, list_size, args.number)
+        print(f'{name:40} {resume_cost:13.1f} us {list_cost:13.1f} us')
+
+    timestamp = '2018-07-20T13:15:02+0300'
+    dateutil_cost = measure(dateutil.parser.parse, timestamp, 1, args.number)
+    fixed_cost = measure(bot.decoding.parse_timestamp, timestamp, 1, args.number)
+    print(f'timestamp: dateutil {dateutil_cost:.2f} us, fixed format {fixed_cost:.2f} us')
+
+
+def parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=2000, help='разборов в одном замере')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_args(sys.argv[1:]))
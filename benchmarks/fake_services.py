@@ -0,0 +1,178 @@
+from typing import Dict, List, Optional
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import json
+import random
+import socket
+import hashlib
+import asyncio
+from aiohttp import web
+
+bench_user_id_base = 9 * 10 ** 12
+"""Идентификаторы пользователей бенчмарка начинаются отсюда, чтобы не пересекаться с настоящими."""
+
+
+def free_port(host: str = '127.0.0.1') -> int:
+    """Найти свободный TCP-порт."""
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def bench_user_id(n: int) -> int:
+    return bench_user_id_base + n
+
+
+def bench_token(user_id: int) -> str:
+    return f'{user_id:064d}'
+
+
+def bench_resume_id(user_id: int, m: int) -> str:
+    return f'bench{user_id}r{m}'
+
+
+class FakeHeadHunter:
+    """Поддельный api.hh.ru для нагрузочных тестов: /me, /resumes/mine, /resumes/{id} и /resumes/{id}/publish.
+
+    Все пользователи и их резюме определяются по токену. Задержка ответа случайна в пределах
+    `latency * [0.5, 1.5)`; `too_often_rate` ответов /publish — 429 touch_limit_exceeded,
+    `error_rate` ответов на любой запрос — 503. GET-ответы с резюме отдаются с ETag,
+    на совпадающий If-None-Match — 304."""
+
+    latency: float
+    too_often_rate: float
+    error_rate: float
+    resumes_per_user: int
+    requests: Counter
+    url: Optional[str]
+
+    def __init__(self, resumes_per_user: int, latency: float = 0.05, too_often_rate: float = 0.0,
+                 error_rate: float = 0.0):
+        self.resumes_per_user = resumes_per_user
+        self.latency = latency
+        self.too_often_rate = too_often_rate
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self.published_at: Dict[str, datetime] = {}
+        self.publishes = Counter()
+        self.created_at = datetime.now(timezone.utc)
+        self.url = None
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/me', self.me)
+        self.app.router.add_get('/resumes/mine', self.resumes_mine)
+        self.app.router.add_get('/resumes/{resume_id}', self.resume)
+        self.app.router.add_post('/resumes/{resume_id}/publish', self.publish)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запустить сервер; если порт не указан, взять любой свободный."""
+        port = port or free_port(host)
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.url = f'http://{host}:{port}'
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request, endpoint: str) -> Optional[web.Response]:
+        """Общая часть всех методов: счётчик, задержка, ошибки и проверка токена."""
+        self.requests[endpoint] += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        if random.random() < self.error_rate:
+            return web.json_response({'errors': [{'type': 'service_unavailable'}]}, status=503)
+        if self._user_id(request) is None:
+            return web.json_response({'errors': [{'type': 'oauth', 'value': 'bad_authorization'}]}, status=403)
+        return None
+
+    @staticmethod
+    def _user_id(request: web.Request) -> Optional[int]:
+        token = request.headers.get('Authorization', '')[len('Bearer '):]
+        return int(token) if token.isdigit() else None
+
+    def _resume_data(self, resume_id: str) -> Dict:
+        published_at = self.published_at.get(resume_id)
+        if published_at:
+            next_publish_at = published_at + timedelta(hours=4)
+        else:
+            next_publish_at = self.created_at - timedelta(minutes=1)
+        return {
+            'id': resume_id,
+            'title': f'Resume {resume_id}',
+            'status': {'id': 'published', 'name': 'опубликовано'},
+            'access': {'type': {'id': 'everyone', 'name': 'видно всем'}},
+            'next_publish_at': next_publish_at.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        }
+
+    @staticmethod
+    def _cacheable_response(request: web.Request, data: Dict) -> web.Response:
+        """JSON-ответ с ETag; на совпадающий If-None-Match — 304 без тела."""
+        body = json.dumps(data, sort_keys=True)
+        etag = '"' + hashlib.md5(body.encode()).hexdigest() + '"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=body, content_type='application/json', headers={'ETag': etag})
+
+    async def me(self, request: web.Request) -> web.Response:
+        error = await self._handle(request, 'me')
+        if error:
+            return error
+        return web.json_response({'first_name': 'Bench', 'last_name': 'User', 'email': 'bench@example.com'})
+
+    async def resumes_mine(self, request: web.Request) -> web.Response:
+        error = await self._handle(request, 'resumes_mine')
+        if error:
+            return error
+        user_id = self._user_id(request)
+        items: List[Dict] = [
+            self._resume_data(bench_resume_id(user_id, m))
+            for m in range(self.resumes_per_user)
+        ]
+        return self._cacheable_response(
+            request,
+            {'items': items, 'found': len(items), 'page': 0, 'pages': 1, 'per_page': 20}
+        )
+
+    async def resume(self, request: web.Request) -> web.Response:
+        error = await self._handle(request, 'resume')
+        if error:
+            return error
+        return self._cacheable_response(request, self._resume_data(request.match_info['resume_id']))
+
+    async def publish(self, request: web.Request) -> web.Response:
+        error = await self._handle(request, 'publish')
+        if error:
+            return error
+        if random.random() < self.too_often_rate:
+            # pretend it was published three hours ago, which matches Retry-After
+            self.published_at[request.match_info['resume_id']] = datetime.now(timezone.utc) - timedelta(hours=3)
+            return web.json_response(
+                {'errors': [{'type': 'resumes', 'value': 'touch_limit_exceeded'}]},
+                status=429,
+                headers={'Retry-After': '3600'}
+            )
+        self.published_at[request.match_info['resume_id']] = datetime.now(timezone.utc)
+        self.publishes[request.match_info['resume_id']] += 1
+        return web.Response(status=204)
+
+
+class FakeTelegramBot:
+    """Заглушка telepot.aio.Bot: запоминает отправленные сообщения вместо отправки в Telegram."""
+
+    latency: float
+    sent: List[Dict]
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = []
+
+    async def sendMessage(self, chat_id, text, parse_mode=None, **kwargs) -> Dict:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        message = {'chat': {'id': chat_id}, 'text': text, 'parse_mode': parse_mode}
+        self.sent.append(message)
+        return message
@@ -0,0 +1,265 @@
+"""Нагрузочный бенчмарк: N пользователей × M резюме против поддельных hh.ru и Telegram.
+
+Нужен отдельный PostgreSQL (те же переменные окружения POSTGRES_*, что и у бота); бенчмарк создаёт
+пользователей с идентификаторами от `bench_user_id_base` и удаляет их перед каждым запуском.
+
+    python -m benchmarks.load --users 200 --resumes 3 --concurrency 20 --latency 0.05
+"""
+from typing import Dict, List
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from aiohttp import ClientSession, TraceConfig
+import bot
+import bot.hh_api
+import bot.resume_toucher
+from bot.webhook import WebhookServer
+from benchmarks.fake_services import (
+    FakeHeadHunter, FakeTelegramBot, bench_resume_id, bench_token, bench_user_id, bench_user_id_base, free_port
+)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def format_latency(values: List[float]) -> str:
+    return f'p50={percentile(values, 50) * 1000:.1f}ms, p99={percentile(values, 99) * 1000:.1f}ms'
+
+
+class RequestTimer:
+    """Замеряет длительность каждого запроса к hh.ru на стороне клиента."""
+
+    durations: List[float]
+
+    def __init__(self):
+        self.durations = []
+        self.trace_config = TraceConfig()
+        self.trace_config.on_request_start.append(self._on_start)
+        self.trace_config.on_request_end.append(self._on_end)
+
+    async def _on_start(self, session, ctx, params) -> None:
+        ctx.started_at = time.monotonic()
+
+    async def _on_end(self, session, ctx, params) -> None:
+        self.durations.append(time.monotonic() - ctx.started_at)
+
+
+async def seed(users: int, resumes: int) -> None:
+    """Пересоздать пользователей и активные резюме бенчмарка; все резюме сразу готовы к поднятию."""
+    now = datetime.now(timezone.utc)
+    async with bot.pg_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute('DELETE FROM public.user WHERE user_id >= %(base)s;', {'base': bench_user_id_base})
+
+            user_rows = [bench_user_id(n) for n in range(users)]
+            values = ', '.join('(%s, %s, false, %s)' for _ in user_rows)
+            params: List = []
+            for user_id in user_rows:
+                params.extend((user_id, bench_token(user_id), now))
+            await cur.execute(
+                f'INSERT INTO public.user (user_id, hh_token, is_waiting_for_token, user_data_updated_at) '
+                f'VALUES {values};',
+                params
+            )
+
+            for user_id in user_rows:
+                values = ', '.join("(%s, %s, 'title', 'published', %s, 'everyone', true, %s)" for _ in range(resumes))
+                params = []
+                for m in range(resumes):
+                    params.extend((bench_resume_id(user_id, m), user_id, now - timedelta(minutes=1),
+                                   now + timedelta(days=7)))
+                await cur.execute(
+                    f'INSERT INTO public.resume '
+                    f'(resume_id, user_id, title, status, next_publish_at, access, is_active, until) '
+                    f'VALUES {values};',
+                    params
+                )
+
+
+def private_message(user_id: int, text: str) -> Dict:
+    return {
+        'message_id': random.randint(1, 10 ** 9),
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+        'chat': {'id': user_id, 'type': 'private', 'first_name': 'Bench'},
+        'date': int(time.time()),
+        'text': text,
+    }
+
+
+chat_commands = ['/help', '/resumes', '/active', '/resume_{resume_id}']
+"""Сообщения, которые каждый пользователь отправляет в чат-сценариях."""
+
+
+async def touch_scenario(args, hh: FakeHeadHunter, timer: RequestTimer) -> None:
+    await seed(args.users, args.resumes)
+    hh.requests.clear()
+    timer.durations.clear()
+
+    report = await bot.resume_toucher.touch_ready_resumes(concurrency=args.concurrency)
+
+    total = args.users * args.resumes
+    print(f'touch: {total} resumes in {report.wall_time:.2f}s ({total / report.wall_time:.1f} resumes/s)')
+    print(f'  outcome: {report}')
+    print(f'  hh requests: {dict(hh.requests)}, {sum(hh.requests.values()) / total:.2f} per resume')
+    print(f'  hh latency: {format_latency(timer.durations)}')
+
+
+async def lease_scenario(args, hh: FakeHeadHunter, timer: RequestTimer) -> None:
+    await seed(args.users, args.resumes)
+    hh.requests.clear()
+    hh.publishes.clear()
+    timer.durations.clear()
+
+    workers = [
+        bot.resume_toucher.LeaseWorker(
+            owner=f'bench-{n}',
+            batch_size=args.lease_batch,
+            concurrency=max(1, args.concurrency // args.lease_workers)
+        )
+        for n in range(args.lease_workers)
+    ]
+    started_at = time.monotonic()
+    await asyncio.gather(*(worker.run(once=True) for worker in workers))
+    wall_time = time.monotonic() - started_at
+
+    total = args.users * args.resumes
+    touched_twice = sum(1 for count in hh.publishes.values() if count > 1)
+    print(f'lease: {total} resumes by {args.lease_workers} workers in {wall_time:.2f}s '
+          f'({total / wall_time:.1f} resumes/s)')
+    print(f'  published: {len(hh.publishes)}, published more than once: {touched_twice}')
+    print(f'  hh requests: {dict(hh.requests)}, {sum(hh.requests.values()) / total:.2f} per resume')
+    print(f'  hh latency: {format_latency(timer.durations)}')
+
+
+async def chat_scenario(args, hh: FakeHeadHunter, timer: RequestTimer, tg: FakeTelegramBot) -> None:
+    await seed(args.users, args.resumes)
+    hh.requests.clear()
+    timer.durations.clear()
+    tg.sent.clear()
+
+    durations: List[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def user_session(user_id: int) -> None:
+        # one user's messages arrive in order
+        async with semaphore:
+            for command in chat_commands:
+                text = command.format(resume_id=bench_resume_id(user_id, 0))
+                started_at = time.monotonic()
+                await bot.on_chat_message(private_message(user_id, text))
+                durations.append(time.monotonic() - started_at)
+
+    started_at = time.monotonic()
+    await asyncio.gather(*(user_session(bench_user_id(n)) for n in range(args.users)))
+    wall_time = time.monotonic() - started_at
+
+    print(f'chat: {len(durations)} messages in {wall_time:.2f}s ({len(durations) / wall_time:.1f} messages/s)')
+    print(f'  message latency: {format_latency(durations)}')
+    print(f'  hh requests: {dict(hh.requests)}, telegram messages sent: {len(tg.sent)}')
+    print(f'  hh latency: {format_latency(timer.durations)}')
+
+
+async def webhook_scenario(args, hh: FakeHeadHunter, tg: FakeTelegramBot) -> None:
+    await seed(args.users, args.resumes)
+    hh.requests.clear()
+    tg.sent.clear()
+
+    port = free_port()
+    server = WebhookServer(bot.on_chat_message, path='/webhook/bench', consumers=args.concurrency)
+    await server.start('127.0.0.1', port)
+    url = f'http://127.0.0.1:{port}/webhook/bench'
+
+    accept_durations: List[float] = []
+    statuses: Dict[int, int] = {}
+    update_id = 0
+
+    started_at = time.monotonic()
+    async with ClientSession() as session:
+        async def post(update: Dict) -> None:
+            request_started_at = time.monotonic()
+            async with session.post(url, json=update) as resp:
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            accept_durations.append(time.monotonic() - request_started_at)
+
+        for command in chat_commands:
+            # every round of updates is posted at once, like a burst from Telegram
+            updates = []
+            for n in range(args.users):
+                update_id += 1
+                user_id = bench_user_id(n)
+                text = command.format(resume_id=bench_resume_id(user_id, 0))
+                updates.append({'update_id': update_id, 'message': private_message(user_id, text)})
+            await asyncio.gather(*(post(update) for update in updates))
+        accepted_at = time.monotonic()
+        await server.join()
+    wall_time = time.monotonic() - started_at
+    await server.stop()
+
+    total = len(accept_durations)
+    print(f'webhook: {total} updates accepted in {accepted_at - started_at:.2f}s, '
+          f'handled in {wall_time:.2f}s ({total / wall_time:.1f} messages/s)')
+    print(f'  accept latency: {format_latency(accept_durations)}, statuses: {statuses}')
+    print(f'  hh requests: {dict(hh.requests)}, telegram messages sent: {len(tg.sent)}')
+
+
+async def main(args) -> None:
+    logging.getLogger('hh-update-bot').setLevel(args.log_level)
+
+    hh = FakeHeadHunter(
+        resumes_per_user=args.resumes,
+        latency=args.latency,
+        too_often_rate=args.too_often_rate,
+        error_rate=args.error_rate
+    )
+    bot.hh_api.HeadHunterAPI.api_url = await hh.start()
+
+    timer = RequestTimer()
+    bot.hh_api.trace_configs.append(timer.trace_config)
+
+    tg = FakeTelegramBot(latency=args.telegram_latency)
+    bot.tg_bot = tg
+
+    await bot.postgres_connect()
+    await bot.postgres_create_tables()
+
+    try:
+        if args.scenario in ('touch', 'all'):
+            await touch_scenario(args, hh, timer)
+        if args.scenario in ('lease', 'all'):
+            await lease_scenario(args, hh, timer)
+        if args.scenario in ('chat', 'all'):
+            await chat_scenario(args, hh, timer, tg)
+        if args.scenario in ('webhook', 'all'):
+            await webhook_scenario(args, hh, tg)
+    finally:
+        await bot.hh_api.close_session()
+        await hh.stop()
+
+
+def parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=('touch', 'lease', 'chat', 'webhook', 'all'), default='all')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--resumes', type=int, default=3, help='резюме на пользователя')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--lease-workers', type=int, default=4, help='воркеров в сценарии lease')
+    parser.add_argument('--lease-batch', type=int, default=50, help='резюме в одной пачке воркера')
+    parser.add_argument('--latency', type=float, default=0.05, help='средняя задержка hh.ru, с')
+    parser.add_argument('--too-often-rate', type=float, default=0.0, help='доля ответов 429 на /publish')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='задержка отправки в Telegram, с')
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(parse_args(sys.argv[1:])))
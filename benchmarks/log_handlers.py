@@ -0,0 +1,122 @@
+"""Микробенчмарк логирования: сколько стоит одна строка лога в потоке цикла событий.
+
+«До» — синхронный StreamHandler и f-строки, как раньше; «после» — обработчики из
+`bot.logging_setup`: тот же поток записи, но с шаблонами и выборкой отладочных строк, и
+очередь с записью в фоновом потоке. Лог пишется во временный файл; --write-delay
+изображает медленный приёмник stderr (например, переполненный буфер docker logs).
+
+    python -m benchmarks.log_handlers --number 20000 --write-delay 0.0001
+"""
+from typing import Callable, List
+import os
+import sys
+import time
+import queue
+import logging
+import logging.handlers
+import argparse
+import tempfile
+from bot.logging_setup import DebugSampler, LazyQueueHandler, RedactingFormatter, log_format
+
+# an update as telepot delivers it; logged on every chat message
+chat_message = {
+    'message_id': 1234,
+    'from': {'id': 123456789, 'is_bot': False, 'first_name': 'Bench', 'language_code': 'ru'},
+    'chat': {'id': 123456789, 'first_name': 'Bench', 'type': 'private'},
+    'date': 1532081702,
+    'text': '/resume_0123456789abcdef0123456789abcdef01234567',
+}
+
+
+class SlowFile:
+    """Файл, каждая запись в который занимает не меньше `delay` секунд."""
+
+    def __init__(self, path: str, delay: float):
+        self._file = open(path, 'w')
+        self._delay = delay
+
+    def write(self, text: str) -> None:
+        self._file.write(text)
+        if self._delay:
+            time.sleep(self._delay)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+
+def log_before(log: logging.Logger, n: int) -> None:
+    log.info(f'Chat: text, private, {chat_message["from"]["id"]}')
+    log.info(chat_message)
+    log.info(f'Models: Getting resume with id {n}...')
+
+
+def log_after(log: logging.Logger, n: int) -> None:
+    log.info('Chat: %s, %s, %s', 'text', 'private', chat_message['from']['id'])
+    log.debug('Chat message: %s', chat_message)
+    log.debug('Models: Getting resume with id %s...', n)
+
+
+def measure(name: str, write: Callable[[logging.Logger, int], None], handler: logging.Handler,
+            number: int, listener: logging.handlers.QueueListener = None) -> None:
+    log = logging.getLogger(f'bench-{name}')
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    log.addHandler(handler)
+    if listener is not None:
+        listener.start()
+
+    cpu_started_at = time.process_time()
+    started_at = time.perf_counter()
+    for n in range(number):
+        write(log, n)
+    caller = time.perf_counter() - started_at
+    if listener is not None:
+        listener.stop()
+    total = time.perf_counter() - started_at
+    cpu = time.process_time() - cpu_started_at
+
+    print(f'{name:32} {caller / number * 10 ** 6:10.1f} us {total / number * 10 ** 6:10.1f} us '
+          f'{cpu / number * 10 ** 6:10.1f} us')
+
+
+def main(args) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        def stream_handler(name: str, formatter: logging.Formatter) -> logging.Handler:
+            handler = logging.StreamHandler(SlowFile(os.path.join(directory, f'{name}.log'), args.write_delay))
+            handler.setFormatter(formatter)
+            return handler
+
+        print(f'{"":32} {"caller":>13} {"with drain":>13} {"cpu":>13}')
+
+        measure('before (sync, f-strings)', log_before,
+                stream_handler('before', logging.Formatter(log_format)), args.number)
+
+        sampled = stream_handler('sync', RedactingFormatter(log_format))
+        sampled.addFilter(DebugSampler(args.burst, args.interval))
+        measure('after (sync, sampled)', log_after, sampled, args.number)
+
+        queue_handler = LazyQueueHandler(queue.Queue())
+        queue_handler.addFilter(DebugSampler(args.burst, args.interval))
+        listener = logging.handlers.QueueListener(
+            queue_handler.queue, stream_handler('queue', RedactingFormatter(log_format))
+        )
+        measure('after (queue, sampled)', log_after, queue_handler, args.number, listener)
+
+        queue_handler = LazyQueueHandler(queue.Queue())
+        listener = logging.handlers.QueueListener(
+            queue_handler.queue, stream_handler('queue-all', RedactingFormatter(log_format))
+        )
+        measure('after (queue, no sampling)', log_after, queue_handler, args.number, listener)
+
+
+def parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=20000, help='итераций (по три строки лога)')
+    parser.add_argument('--write-delay', type=float, default=0.0, help='задержка каждой записи в лог, с')
+    parser.add_argument('--burst', type=int, default=20, help='отладочных строк из одного места за интервал')
+    parser.add_argument('--interval', type=float, default=10, help='интервал выборки, с')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_args(sys.argv[1:]))
@@ -0,0 +1,53 @@
+"""Модель нагрузки планировщика подъёмов: насколько ровно идут подъёмы без разнесения и с ним.
+
+Резюме активируются кучно (`--spread` секунд вокруг одного момента), после подъёма hh.ru даёт
+одинаковую паузу `--cooldown`. Для нескольких циклов подъёмов выводится отчёт `TouchPlanner`
+по окну, в котором лежат подъёмы цикла, и на сколько в среднем и максимум подъём откладывался.
+
+    python -m benchmarks.planner --resumes 20000 --spread 300 --cycles 3
+"""
+from typing import Dict, List
+import sys
+import random
+import argparse
+from bot.touch_planner import TouchPlanner
+
+
+def simulate(resumes: int, spread: float, cooldown: float, cycles: int, planner: TouchPlanner) -> None:
+    earliest: Dict[str, float] = {f'r{n}': random.gauss(0, spread) for n in range(resumes)}
+    for cycle in range(cycles):
+        slots = planner.plan_many(earliest.items())
+        delays = [slots[resume_id] - at for resume_id, at in earliest.items()]
+
+        start, end = min(slots.values()), max(slots.values())
+        report = planner.report(start, end + planner.bucket)
+        print(f'  cycle {cycle}: {report}, '
+              f'delay avg={sum(delays) / len(delays):.0f}s, max={max(delays):.0f}s, window={end - start:.0f}s')
+
+        # every resume is touched at its slot and becomes publishable again after the cooldown
+        for resume_id, at in slots.items():
+            planner.release(resume_id)
+            earliest[resume_id] = at + cooldown
+
+
+def main(args) -> None:
+    random.seed(args.seed)
+    for name, max_delay in (('next_publish_at as is', 0.0), (f'planned, max delay {args.max_delay:.0f}s', args.max_delay)):
+        print(name)
+        simulate(args.resumes, args.spread, args.cooldown, args.cycles, TouchPlanner(args.bucket, max_delay))
+
+
+def parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resumes', type=int, default=20000)
+    parser.add_argument('--spread', type=float, default=300, help='разброс времени активации, с')
+    parser.add_argument('--cooldown', type=float, default=4 * 60 * 60, help='пауза hh.ru после подъёма, с')
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--bucket', type=float, default=10, help='ширина корзины, с')
+    parser.add_argument('--max-delay', type=float, default=600, help='на сколько можно отложить подъём, с')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_args(sys.argv[1:]))
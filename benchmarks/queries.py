@@ -0,0 +1,85 @@
+"""Микробенчмарк частых запросов bot.models: подготовленные запросы против отправки текста каждый раз.
+
+Нужен отдельный PostgreSQL (переменные окружения POSTGRES_*, как у бота). Для каждого запроса
+замеряются задержка одного вызова и процессорное время бота на вызов (без времени сервера).
+
+    python -m benchmarks.queries --number 2000
+"""
+from typing import Awaitable, Callable, Dict, List
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import bot
+import bot.repository
+from bot.models import HeadHunterResume, TelegramUser, user_cache
+from benchmarks.fake_services import bench_resume_id, bench_user_id
+from benchmarks.load import percentile, seed
+
+
+async def measure(call: Callable[[], Awaitable], number: int) -> Dict[str, float]:
+    """Задержки вызовов по одному и процессорное время на вызов, в микросекундах."""
+    for _ in range(min(number, 50)):
+        await call()
+
+    durations: List[float] = []
+    cpu_started_at = time.process_time()
+    for _ in range(number):
+        started_at = time.perf_counter()
+        await call()
+        durations.append(time.perf_counter() - started_at)
+    cpu = time.process_time() - cpu_started_at
+
+    return {
+        'p50': percentile(durations, 50) * 10 ** 6,
+        'p99': percentile(durations, 99) * 10 ** 6,
+        'cpu': cpu / number * 10 ** 6,
+    }
+
+
+async def main(args) -> None:
+    logging.getLogger('hh-update-bot').setLevel(args.log_level)
+
+    await bot.postgres_connect()
+    await bot.postgres_create_tables()
+    await seed(args.users, args.resumes)
+
+    user_id = bench_user_id(0)
+    resume = await HeadHunterResume.get(bench_resume_id(user_id, 0))
+    user = await TelegramUser.get(user_id)
+
+    async def get_user() -> None:
+        # the user cache would answer without a query
+        user_cache.invalidate(user_id)
+        await TelegramUser.get(user_id)
+
+    queries: Dict[str, Callable[[], Awaitable]] = {
+        'resume.get': lambda: HeadHunterResume.get(resume.resume_id),
+        'resume.update': resume.update,
+        'resume.get_user_active_resume_list': lambda: HeadHunterResume.get_user_active_resume_list(user),
+        'user.get': get_user,
+        'user.update': user.update,
+    }
+
+    print(f'{"":36} {"prepared":>8} {"p50":>10} {"p99":>10} {"cpu/call":>10}')
+    for name, call in queries.items():
+        for prepare in (False, True):
+            bot.repository.prepare_statements = prepare
+            result = await measure(call, args.number)
+            print(f'{name:36} {"yes" if prepare else "no":>8} '
+                  f'{result["p50"]:8.0f}us {result["p99"]:8.0f}us {result["cpu"]:8.0f}us')
+
+
+def parse_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=2000, help='вызовов каждого запроса в одном замере')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--resumes', type=int, default=3, help='резюме на пользователя')
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(parse_args(sys.argv[1:])))
@@ -1,27 +1,34 @@
 from typing import Optional, Dict, List, Any
+from datetime import datetime, timezone
 import os
 import re
+import hashlib
 import logging
 import random
 import asyncio
 import aiopg
 import telepot
 import telepot.aio
-from bot.hh_api import HeadHunterAPI, HeadHunterAuthError
+from bot.hh_api import (
+    HeadHunterAPI, HeadHunterAuthError, HeadHunterNotFoundError, HeadHunterRateLimitError, HeadHunterUnavailableError
+)
+import bot.circuit_breaker
 import bot.models
+import bot.migrations
+import bot.metrics
+from bot.logging_setup import setup_logging
+from bot.webhook import WebhookServer
+from bot.outbox import Outbox, PRIORITY_INTERACTIVE, PRIORITY_BULK
 from telepot.aio.loop import MessageLoop
 
 # logging
 log = logging.getLogger('hh-update-bot')
-log.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-ch = logging.StreamHandler()
-ch.setFormatter(formatter)
-log.addHandler(ch)
+setup_logging(log)
 
 tg_bot: telepot.aio.Bot
 pg_pool = None
+webhook_server: Optional[WebhookServer] = None
+outbox_queue: Optional[Outbox] = None
 token_pattern = re.compile(r"^[A-Z0-9]{64}$")
 
 
@@ -76,21 +83,54 @@ resume_selected_message = ('Ок, резюме <b>"{title}"</b> будет ре
 active_resumes_message = 'Продвигаемые резюме:\n\n'
 resume_not_found_message = 'Резюме не найдено.'
 resume_deactivated_message = 'Резюме больше не будет подниматься в поиске.'
+hh_busy_message = 'hh.ru сейчас перегружен запросами. Попробуй ещё раз через пару минут.'
+hh_unavailable_message = 'hh.ru сейчас не отвечает. Попробуй ещё раз через несколько минут.'
 
 
-async def send_message(chat_id, message):
+async def send_html(chat_id, message):
     await tg_bot.sendMessage(chat_id, message, parse_mode='HTML')
 
 
+async def send_message(chat_id, message, priority: int = PRIORITY_INTERACTIVE):
+    """Отправить сообщение через очередь исходящих, не дожидаясь Telegram (если очередь запущена)."""
+    if outbox_queue is None:
+        await send_html(chat_id, message)
+    else:
+        outbox_queue.enqueue(chat_id, message, priority)
+
+
 async def on_unknown_message(chat_id):
     msg = random.choice(incorrect_message_answers)
     await send_message(chat_id, msg)
 
 
+chat_commands = ('/start', '/help', '/token', '/cancel', '/resumes', '/active')
+"""Команды без параметров; у остальных сообщений в метриках только общий вид."""
+
+
+def command_name(msg) -> str:
+    """Название команды для метрик, без идентификаторов резюме и прочих данных пользователя."""
+    command = msg.get('text', '').lower()
+    if not command:
+        return 'non_text'
+    if command in chat_commands:
+        return command
+    if command.startswith('/resume_'):
+        return '/resume_'
+    if command.startswith('/deactivate_'):
+        return '/deactivate_'
+    return 'text'
+
+
 async def on_chat_message(msg):
+    with bot.metrics.chat_command_duration.time(command=command_name(msg)):
+        await handle_chat_message(msg)
+
+
+async def handle_chat_message(msg):
     content_type, chat_type, user_id = telepot.glance(msg)
-    log.info(f"Chat: {content_type}, {chat_type}, {user_id}")
-    log.info(msg)
+    log.info('Chat: %s, %s, %s', content_type, chat_type, user_id)
+    log.debug('Chat message: %s', msg)
 
     # answer in private chats only
     if chat_type != 'private':
@@ -105,7 +145,7 @@ async def on_chat_message(msg):
 
     # unknown user
     if not user:
-        log.info(f'Unknown user: {user_id}')
+        log.info('Unknown user: %s', user_id)
         user = bot.models.TelegramUser(
             user_id=int(user_id)
         )
@@ -114,7 +154,7 @@ async def on_chat_message(msg):
         return
 
     # known user
-    log.info(f'Known user: {user_id}')
+    log.debug('Known user: %s', user_id)
 
     command = msg['text'].lower()
 
@@ -154,15 +194,24 @@ async def activate_resume(user: bot.models.TelegramUser, resume_id: str) -> None
     assert user.hh_token
 
     user_id = user.user_id
-    hh_token = user.hh_token
 
     resume: bot.models.HeadHunterResume
 
     try:
-        async with await HeadHunterAPI.create(hh_token) as api:
+        async with await HeadHunterAPI.for_user(user) as api:
             resume = await api.get_resume(resume_id)
     except HeadHunterAuthError:
         await send_message(user_id, token_incorrect_message)
+        return
+    except HeadHunterNotFoundError:
+        await send_message(user_id, resume_not_found_message)
+        return
+    except HeadHunterRateLimitError:
+        await send_message(user_id, hh_busy_message)
+        return
+    except HeadHunterUnavailableError:
+        await send_message(user_id, hh_unavailable_message)
+        return
 
     # set user_id
     resume.user_id = user_id
@@ -208,11 +257,11 @@ async def save_token(user: bot.models.TelegramUser, hh_token: str) -> None:
 
     if not token_pattern.match(hh_token):
         # token mismatched pattern
-        log.info(f'Token for chat {user_id} NOT matched pattern: {hh_token}')
+        log.info('Token for chat %s NOT matched pattern', user_id)
         await send_message(user_id, token_incorrect_message)
         return
 
-    log.info(f'Token for chat {user_id} matched pattern.')
+    log.info('Token for chat %s matched pattern.', user_id)
 
     # create API object
     try:
@@ -223,10 +272,18 @@ async def save_token(user: bot.models.TelegramUser, hh_token: str) -> None:
             user.first_name = api.first_name
             user.last_name = api.last_name
             user.email = api.email
-            await user.update()
+            user.user_data_updated_at = datetime.now(timezone.utc)
+            # the new token works, so lift the quarantine of the old one
+            await user.update_token()
     except HeadHunterAuthError:
         await send_message(user_id, token_incorrect_message)
         return
+    except HeadHunterRateLimitError:
+        await send_message(user_id, hh_busy_message)
+        return
+    except HeadHunterUnavailableError:
+        await send_message(user_id, hh_unavailable_message)
+        return
 
     await get_resume_list(user)
 
@@ -236,15 +293,17 @@ async def get_resume_list(user: bot.models.TelegramUser) -> None:
     assert user.hh_token
 
     user_id = user.user_id
-    hh_token = user.hh_token
 
-    log.info(f'Get resume list for user: {user_id}, token: {hh_token}')
+    log.info('Get resume list for user: %s', user_id)
 
     try:
-        async with await HeadHunterAPI.create(hh_token) as api:
+        async with await HeadHunterAPI.for_user(user) as api:
             # get resume list
             resumes: List[bot.models.HeadHunterResume] = await api.get_resume_list()
 
+            # keep titles and statuses fresh and deactivate resumes deleted on hh.ru
+            await bot.models.HeadHunterResume.sync_user_resumes(user_id, resumes)
+
             if resumes:
                 msg = select_resume_message
                 msg += '\n\n'.join(f'<b>{r.title}</b>\n/resume_{r.resume_id}' for r in resumes)
@@ -255,6 +314,12 @@ async def get_resume_list(user: bot.models.TelegramUser) -> None:
     except HeadHunterAuthError:
         await send_message(user_id, token_incorrect_message)
         return
+    except HeadHunterRateLimitError:
+        await send_message(user_id, hh_busy_message)
+        return
+    except HeadHunterUnavailableError:
+        await send_message(user_id, hh_unavailable_message)
+        return
 
 
 async def postgres_connect() -> None:
@@ -276,23 +341,103 @@ async def postgres_connect() -> None:
 
 
 async def postgres_create_tables() -> None:
-    await bot.models.TelegramUser.create_table()
-    await bot.models.HeadHunterResume.create_table()
+    await bot.migrations.migrate()
 
 
-async def main():
-    global tg_bot
+def telegram_connect() -> None:
+    """Создать клиента Telegram и запустить очередь исходящих сообщений."""
+    global tg_bot, outbox_queue
 
     # get environment variables
     TOKEN: str = os.environ['BOT_TOKEN']
+    OUTBOX_SHARDS: int = int(os.environ.get('OUTBOX_SHARDS', 4))
+    OUTBOX_RATE: float = float(os.environ.get('OUTBOX_RATE', 30))
+    OUTBOX_CHAT_RATE: float = float(os.environ.get('OUTBOX_CHAT_RATE', 1))
 
     tg_bot = telepot.aio.Bot(TOKEN)
+    outbox_queue = Outbox(send_html, shards=OUTBOX_SHARDS, global_rate=OUTBOX_RATE, chat_rate=OUTBOX_CHAT_RATE)
+    outbox_queue.start()
+
+
+def collect_metrics() -> None:
+    """Скопировать в метрики статистику кэша, очереди исходящих и клиента hh.ru."""
+    for name, cache in (('user', bot.models.user_cache), ('hh_response', bot.hh_api.response_cache)):
+        bot.metrics.cache_entries.set(len(cache), cache=name)
+        bot.metrics.cache_hits.set(cache.hits, cache=name)
+        bot.metrics.cache_misses.set(cache.misses, cache=name)
+
+    if outbox_queue is not None:
+        bot.metrics.outbox_queue_length.set(len(outbox_queue))
+        for state in ('queued', 'sent', 'retried', 'failed'):
+            bot.metrics.outbox_messages.set(getattr(outbox_queue.stats, state), state=state)
+
+    bot.metrics.hh_connections.set(bot.hh_api.connection_stats.created, state='created')
+    bot.metrics.hh_connections.set(bot.hh_api.connection_stats.reused, state='reused')
+    bot.metrics.hh_rate_limit.set(bot.hh_api.rate_limiter.global_rate)
+    for stat in ('requests', 'delayed', 'delay_total', 'throttled', 'backoffs'):
+        bot.metrics.hh_rate_limiter.set(getattr(bot.hh_api.rate_limiter.stats, stat), stat=stat)
+    bot.metrics.hh_circuit_state.set(bot.circuit_breaker.states.index(bot.hh_api.breaker.state))
+    for stat in ('failures', 'opened', 'rejected'):
+        bot.metrics.hh_circuit_breaker.set(getattr(bot.hh_api.breaker.stats, stat), stat=stat)
+
+
+bot.metrics.collectors.append(collect_metrics)
+
+
+async def start_metrics() -> None:
+    """Отдавать метрики по HTTP, если задан METRICS_PORT."""
+    # get environment variables
+    METRICS_HOST: str = os.environ.get('METRICS_HOST', '0.0.0.0')
+    METRICS_PORT: Optional[str] = os.environ.get('METRICS_PORT')
+
+    if METRICS_PORT:
+        await bot.metrics.start_server(METRICS_HOST, int(METRICS_PORT))
+
+
+async def main():
+    # get environment variables
+    TOKEN: str = os.environ['BOT_TOKEN']
+
+    telegram_connect()
+    await start_metrics()
 
     loop = asyncio.get_event_loop()
 
     await postgres_connect()
     await postgres_create_tables()
 
-    loop.create_task(MessageLoop(tg_bot, {'chat': on_chat_message}).run_forever())
+    loop.create_task(bot.models.watch_user_changes())
+
+    WEBHOOK_URL: Optional[str] = os.environ.get('WEBHOOK_URL')
+
+    if WEBHOOK_URL:
+        await start_webhook(TOKEN, WEBHOOK_URL)
+    else:
+        # polling doesn't work while a webhook is set
+        await tg_bot.deleteWebhook()
+        loop.create_task(MessageLoop(tg_bot, {'chat': on_chat_message}).run_forever())
 
     log.info('Listening for messages in Telegram...')
+
+
+async def start_webhook(token: str, url: str) -> None:
+    """Принимать сообщения через вебхук по адресу `url` вместо long polling."""
+    global webhook_server
+
+    # get environment variables
+    WEBHOOK_HOST: str = os.environ.get('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT: int = int(os.environ.get('WEBHOOK_PORT', 8080))
+    WEBHOOK_CONSUMERS: int = int(os.environ.get('WEBHOOK_CONSUMERS', 8))
+    WEBHOOK_QUEUE_SIZE: int = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 1000))
+
+    # a path nobody can guess protects the endpoint from fake updates
+    path = '/webhook/' + hashlib.sha256(token.encode()).hexdigest()[:32]
+
+    webhook_server = WebhookServer(
+        on_chat_message,
+        path=path,
+        consumers=WEBHOOK_CONSUMERS,
+        queue_size=WEBHOOK_QUEUE_SIZE
+    )
+    await webhook_server.start(WEBHOOK_HOST, WEBHOOK_PORT)
+    await tg_bot.setWebhook(url.rstrip('/') + path)
@@ -6,8 +6,15 @@ if __name__ == '__main__':
     loop = asyncio.get_event_loop()
 
     if len(sys.argv) > 1 and sys.argv[1] == 'touch':
-        loop.create_task(bot.resume_toucher.main())
+        once = '--once' in sys.argv
+        main = bot.resume_toucher.main(once=once)
     else:
-        loop.create_task(bot.main())
+        once = False
+        main = bot.main()
 
-    loop.run_forever()
+    if once:
+        # a single pass exits when it is done, so cron or a one-off container sees it finish
+        loop.run_until_complete(main)
+    else:
+        loop.create_task(main)
+        loop.run_forever()
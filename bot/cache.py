@@ -0,0 +1,57 @@
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+from collections import OrderedDict
+import time
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class TTLCache(Generic[K, V]):
+    """LRU-кэш ограниченного размера, записи которого устаревают через `ttl` секунд.
+
+    :param clock: часы, по которым отсчитывается возраст записей; по умолчанию time.monotonic
+    """
+
+    max_size: int
+    ttl: float
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._items: 'OrderedDict[K, Any]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: K) -> Optional[V]:
+        item = self._items.get(key)
+        if item is None or item[0] < self._clock():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key: K, value: V) -> None:
+        self._items[key] = (self._clock() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key: K) -> None:
+        self._items.pop(key, None)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        hit_ratio = self.hits / total if total else 0.0
+        return f'size={len(self)}, hits={self.hits}, misses={self.misses}, hit_ratio={hit_ratio:.2f}'
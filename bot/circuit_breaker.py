@@ -0,0 +1,127 @@
+from typing import Callable
+import time
+import logging
+
+log = logging.getLogger('hh-update-bot')
+
+CLOSED = 'closed'
+"""Запросы идут как обычно."""
+
+OPEN = 'open'
+"""Сервис считается недоступным: запросы отклоняются сразу, не дожидаясь таймаута."""
+
+HALF_OPEN = 'half_open'
+"""Пробный режим: пропускается несколько запросов, чтобы проверить, ожил ли сервис."""
+
+states = (CLOSED, HALF_OPEN, OPEN)
+"""Состояния в порядке ухудшения; номер состояния отдаётся в метриках."""
+
+
+class CircuitBreakerStats:
+    """Счётчики автоматического выключателя."""
+
+    failures: int
+    """Сколько запросов завершились ошибкой, из-за которой сервис считается недоступным."""
+
+    opened: int
+    """Сколько раз выключатель размыкался."""
+
+    rejected: int
+    """Сколько запросов отклонено без обращения к сервису."""
+
+    def __init__(self):
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def __str__(self) -> str:
+        return f'failures={self.failures}, opened={self.opened}, rejected={self.rejected}'
+
+
+class CircuitBreaker:
+    """Автоматический выключатель для запросов к внешнему сервису.
+
+    После `failure_threshold` ошибок подряд выключатель размыкается, и в течение `reset_timeout`
+    секунд все запросы отклоняются сразу. Затем он пропускает до `half_open_calls` пробных запросов:
+    успешный пробный запрос замыкает выключатель, неудачный снова размыкает его.
+
+    :param clock: часы для отсчёта `reset_timeout`; по умолчанию time.monotonic
+    """
+
+    name: str
+    failure_threshold: int
+    reset_timeout: float
+    half_open_calls: int
+    stats: CircuitBreakerStats
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30, half_open_calls: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.stats = CircuitBreakerStats()
+
+        self._clock = clock
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._set_state(HALF_OPEN)
+            self._trials = 0
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        """Отклоняются ли сейчас запросы (пробные запросы полуоткрытого состояния не в счёт)."""
+        return self.state == OPEN
+
+    @property
+    def retry_after(self) -> float:
+        """Через сколько секунд выключатель пропустит пробный запрос; 0, если запросы идут."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - self._clock())
+
+    def _set_state(self, state: str) -> None:
+        if state != self._state:
+            log.warning(f'Circuit breaker {self.name}: {self._state} -> {state}')
+            self._state = state
+
+    def _open(self) -> None:
+        self._set_state(OPEN)
+        self._opened_at = self._clock()
+        self.stats.opened += 1
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос.
+
+        Если можно, после запроса нужно вызвать `on_success`, `on_failure` или `on_cancel`."""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._trials < self.half_open_calls:
+            self._trials += 1
+            return True
+        self.stats.rejected += 1
+        return False
+
+    def on_success(self) -> None:
+        self._failures = 0
+        if self._state == HALF_OPEN:
+            self._set_state(CLOSED)
+
+    def on_cancel(self) -> None:
+        """Запрос, разрешённый `allow`, отменён до ответа: не считать его ни успехом, ни ошибкой."""
+        if self._state == HALF_OPEN and self._trials:
+            self._trials -= 1
+
+    def on_failure(self) -> None:
+        self.stats.failures += 1
+        self._failures += 1
+        if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+            self._open()
@@ -0,0 +1,70 @@
+from typing import Any, Callable, Dict, Optional, Union
+from datetime import datetime, timedelta, timezone
+import os
+import json
+import dateutil.parser
+
+JSONLoads = Callable[[Union[bytes, str]], Any]
+
+
+def _json_backends() -> Dict[str, JSONLoads]:
+    """Доступные реализации json.loads, от самой быстрой к самой медленной."""
+    backends: Dict[str, JSONLoads] = {}
+    try:
+        import orjson
+        backends['orjson'] = orjson.loads
+    except ImportError:
+        pass
+    try:
+        import ujson
+        backends['ujson'] = ujson.loads
+    except ImportError:
+        pass
+    backends['json'] = json.loads
+    return backends
+
+
+json_backends: Dict[str, JSONLoads] = _json_backends()
+
+json_backend: str = os.environ.get('HH_JSON_BACKEND') or next(iter(json_backends))
+"""Какой библиотекой разбирать JSON; по умолчанию самой быстрой из установленных (orjson, ujson, json)."""
+
+if json_backend not in json_backends:
+    raise RuntimeError(f'JSON backend {json_backend} is not installed')
+
+loads: JSONLoads = json_backends[json_backend]
+"""Разобрать JSON выбранной библиотекой."""
+
+_timezones: Dict[str, timezone] = {}
+
+
+def _timezone(offset: str) -> Optional[timezone]:
+    """Часовой пояс по смещению вида +0300 или +03:00; None, если смещение в другом формате."""
+    tz = _timezones.get(offset)
+    if tz is None:
+        digits = offset[1:].replace(':', '')
+        if offset[:1] not in '+-' or len(digits) != 4 or not digits.isdigit():
+            return None
+        delta = timedelta(hours=int(digits[:2]), minutes=int(digits[2:]))
+        tz = _timezones[offset] = timezone(-delta if offset[0] == '-' else delta)
+    return tz
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Разобрать время в формате, в котором его отдаёт hh.ru: 2018-07-20T12:34:56+0300.
+
+    Строки в любом другом формате разбираются dateutil.
+    """
+    if (len(value) >= 24 and value[4] == '-' and value[7] == '-' and value[10] == 'T'
+            and value[13] == ':' and value[16] == ':'):
+        tz = _timezone(value[19:])
+        if tz is not None:
+            try:
+                return datetime(
+                    int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                    int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                    tzinfo=tz
+                )
+            except ValueError:
+                pass
+    return dateutil.parser.parse(value)
@@ -1,10 +1,228 @@
-from typing import Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+import os
+import copy
+import time
+import random
+import asyncio
+import email.utils
+from datetime import datetime, timedelta, timezone
+from aiohttp import ClientError, ClientTimeout, TCPConnector, TraceConfig
 from aiohttp.client import ClientSession
-import dateutil.parser
 import bot.models
+import bot.metrics
+import bot.decoding
+from bot.cache import TTLCache
+from bot.circuit_breaker import CircuitBreaker
+from bot.rate_limiter import RateLimiter
 
 APIToken = str
 
+pool_limit: int = int(os.environ.get('HH_POOL_LIMIT', 100))
+"""Максимальное количество одновременных соединений с api.hh.ru."""
+
+keepalive_timeout: float = float(os.environ.get('HH_KEEPALIVE_TIMEOUT', 30))
+"""Сколько секунд держать открытым простаивающее соединение."""
+
+dns_cache_ttl: int = int(os.environ.get('HH_DNS_CACHE_TTL', 300))
+"""Сколько секунд кэшировать DNS-ответы."""
+
+user_data_ttl = timedelta(seconds=int(os.environ.get('HH_USER_DATA_TTL', 24 * 60 * 60)))
+"""Как долго доверять сохранённым в БД имени, фамилии и email пользователя."""
+
+resume_fetch_concurrency: int = int(os.environ.get('HH_RESUME_FETCH_CONCURRENCY', 4))
+"""Сколько резюме одного пользователя запрашивать одновременно."""
+
+resume_fields = ('id', 'title', 'status', 'access', 'next_publish_at')
+"""Поля, из которых строится HeadHunterResume."""
+
+publish_cooldown = timedelta(seconds=int(os.environ.get('HH_PUBLISH_COOLDOWN', 4 * 60 * 60)))
+"""Через сколько после публикации hh.ru разрешает опубликовать резюме снова."""
+
+touch_verify_rate: float = float(os.environ.get('HH_TOUCH_VERIFY_RATE', 0.05))
+"""Доля публикаций, после которых время следующей публикации сверяется с hh.ru."""
+
+touch_verify_tolerance = timedelta(minutes=5)
+"""Допустимое расхождение вычисленного и настоящего времени следующей публикации."""
+
+throttle_retries: int = int(os.environ.get('HH_THROTTLE_RETRIES', 3))
+"""Сколько раз повторить запрос, на который hh.ru ответил 429 или 5xx."""
+
+connect_timeout: float = float(os.environ.get('HH_CONNECT_TIMEOUT', 5))
+"""Сколько секунд ждать установки TCP-соединения с api.hh.ru."""
+
+read_timeout: float = float(os.environ.get('HH_READ_TIMEOUT', 10))
+"""Сколько секунд ждать очередной порции ответа api.hh.ru."""
+
+endpoint_read_timeouts: Dict[str, float] = {
+    'resumes_mine': float(os.environ.get('HH_RESUMES_MINE_READ_TIMEOUT', 20)),
+    'publish': float(os.environ.get('HH_PUBLISH_READ_TIMEOUT', 15)),
+}
+"""Таймауты чтения для методов API, которые отвечают дольше остальных."""
+
+resume_cache_fresh: float = float(os.environ.get('HH_RESUME_CACHE_FRESH', 60))
+"""Сколько секунд отдавать резюме из кэша, не спрашивая hh.ru."""
+
+
+class CachedResponse:
+    """Разобранный ответ на GET-запрос вместе с валидаторами для условного запроса."""
+
+    value: Any
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fresh_until: float
+
+    def __init__(self, value: Any, etag: Optional[str], last_modified: Optional[str]):
+        self.value = value
+        self.etag = etag
+        self.last_modified = last_modified
+        self.refresh()
+
+    def refresh(self) -> None:
+        self.fresh_until = time.monotonic() + resume_cache_fresh
+
+    @property
+    def is_fresh(self) -> bool:
+        return self.fresh_until > time.monotonic()
+
+
+response_cache: 'TTLCache[Tuple[APIToken, str], CachedResponse]' = TTLCache(
+    max_size=int(os.environ.get('HH_RESUME_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('HH_RESUME_CACHE_TTL', 60 * 60))
+)
+"""Кэш резюме и списков резюме по (токен, путь запроса).
+
+Первые `resume_cache_fresh` секунд запись отдаётся без запроса, потом — после условного запроса
+с If-None-Match/If-Modified-Since, на который hh.ru отвечает 304, если ничего не изменилось.
+После публикации резюме его записи сбрасываются."""
+
+rate_limiter = RateLimiter(
+    global_rate=float(os.environ.get('HH_RATE_LIMIT', 20)),
+    token_rate=float(os.environ.get('HH_TOKEN_RATE_LIMIT', 2)),
+    endpoint_rates={
+        'publish': float(os.environ.get('HH_PUBLISH_RATE_LIMIT', 10)),
+    }
+)
+"""Общий для процесса ограничитель частоты запросов к api.hh.ru."""
+
+breaker = CircuitBreaker(
+    'hh.ru',
+    failure_threshold=int(os.environ.get('HH_BREAKER_FAILURES', 5)),
+    reset_timeout=float(os.environ.get('HH_BREAKER_RESET_TIMEOUT', 30))
+)
+"""Общий для процесса автоматический выключатель: размыкается, когда api.hh.ru не отвечает или отвечает 5xx."""
+
+
+def request_timeout(endpoint: str) -> ClientTimeout:
+    """Таймауты запроса к методу API `endpoint`."""
+    return ClientTimeout(sock_connect=connect_timeout, sock_read=endpoint_read_timeouts.get(endpoint, read_timeout))
+
+
+class ConnectionStats:
+    """Статистика переиспользования соединений общей сессии."""
+
+    created: int
+    """Сколько новых соединений открыто."""
+
+    reused: int
+    """Сколько раз запрос ушёл по уже открытому соединению."""
+
+    def __init__(self):
+        self.created = 0
+        self.reused = 0
+
+    @property
+    def reuse_ratio(self) -> float:
+        total = self.created + self.reused
+        return self.reused / total if total else 0.0
+
+    def __str__(self) -> str:
+        return f'created={self.created}, reused={self.reused}, reuse_ratio={self.reuse_ratio:.2f}'
+
+
+connection_stats = ConnectionStats()
+
+trace_configs: List[TraceConfig] = []
+"""Дополнительные TraceConfig для общей сессии; нужно добавить до первого запроса."""
+
+_session: Optional[ClientSession] = None
+
+
+async def _on_connection_create_end(session, ctx, params) -> None:
+    connection_stats.created += 1
+
+
+async def _on_connection_reuseconn(session, ctx, params) -> None:
+    connection_stats.reused += 1
+
+
+def get_session() -> ClientSession:
+    """Общая для всего процесса сессия с пулом keep-alive соединений.
+
+    Создаётся при первом обращении; авторизация передаётся в заголовках каждого запроса.
+    """
+    global _session
+    if _session is None or _session.closed:
+        stats_config = TraceConfig()
+        stats_config.on_connection_create_end.append(_on_connection_create_end)
+        stats_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+
+        connector = TCPConnector(
+            limit=pool_limit,
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_ttl
+        )
+        _session = ClientSession(connector=connector, trace_configs=[stats_config] + trace_configs)
+    return _session
+
+
+async def close_session() -> None:
+    """Закрыть общую сессию и все её соединения."""
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[timedelta]:
+    """Разобрать заголовок Retry-After: число секунд или HTTP-дата."""
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    if value.isdigit():
+        return timedelta(seconds=int(value))
+    try:
+        return email.utils.parsedate_to_datetime(value) - datetime.now(timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+class APIResponse:
+    """Полностью прочитанный ответ API hh.ru."""
+
+    status: int
+    headers: Mapping[str, str]
+    body: bytes
+
+    def __init__(self, status: int, headers: Mapping[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> Any:
+        return bot.decoding.loads(self.body)
+
+    def has_error(self, value: str) -> bool:
+        """Есть ли среди ошибок в теле ответа ошибка с указанным значением.
+
+        См. https://github.com/hhru/api/blob/master/docs/errors.md
+        """
+        try:
+            errors = self.json().get('errors') or []
+        except (ValueError, AttributeError):
+            return False
+        return any(isinstance(e, dict) and e.get('value') == value for e in errors)
+
 
 class HeadHunterAuthError(Exception):
     """Ошибка авторизации в API hh.ru."""
@@ -14,6 +232,19 @@ class HeadHunterResumeUpdateTooOftenError(Exception):
     """Слишком частое обновление резюме в API hh.ru."""
 
 
+class HeadHunterRateLimitError(Exception):
+    """hh.ru ограничивает частоту запросов и не ответил даже после повторных попыток."""
+
+
+class HeadHunterUnavailableError(Exception):
+    """api.hh.ru не отвечает: запрос завершился таймаутом, ошибкой соединения или ошибкой сервера,
+    либо выключатель разомкнут."""
+
+
+class HeadHunterNotFoundError(Exception):
+    """Запрошенный объект не найден в API hh.ru (например, резюме удалено)."""
+
+
 class HeadHunterResumeUpdateError(Exception):
     """Ошибка обновления резюме в API hh.ru.
 
@@ -32,29 +263,52 @@ class HeadHunterAPI:
 
     api_token: APIToken
     headers: Dict[str, str]
-    session: ClientSession
 
     first_name: str
     last_name: str
     email: str
 
     @classmethod
-    async def create(cls, api_token: APIToken) -> 'HeadHunterAPI':
+    async def create(cls, api_token: APIToken, verify: bool = True) -> 'HeadHunterAPI':
         """Метод, создающий новый объект API hh.ru.
 
         :param api_token: токен для API; можно взять отсюда: https://dev.hh.ru/admin?new-token=true
+        :param verify: проверить токен и получить данные о пользователе запросом к /me
         :raise HeadHunterAuthError: если произошла ошибка авторизации
         :return: объект типа HeadHunterAPI с данными о пользователе API
         """
         api = HeadHunterAPI()
         api.api_token = api_token
         api.headers = {'Authorization': f'Bearer {api_token}'}
-        api.session = ClientSession(headers=api.headers)
-        try:
+        if verify:
             await api.get_user_data()
-        except HeadHunterAuthError:
-            await api.session.close()
-            raise
+
+        return api
+
+    @classmethod
+    async def for_user(cls, user: 'bot.models.TelegramUser') -> 'HeadHunterAPI':
+        """Метод, создающий объект API по токену, уже сохранённому в БД.
+
+        Токен не проверяется: ошибка авторизации обнаружится при первом настоящем запросе.
+        Данные о пользователе запрашиваются у /me и сохраняются, только если устарели.
+
+        :param user: пользователь с токеном
+        :raise HeadHunterAuthError: если данные пришлось обновить и произошла ошибка авторизации
+        :return: объект типа HeadHunterAPI с данными о пользователе API
+        """
+        api = await cls.create(user.hh_token, verify=False)
+
+        if user.is_user_data_stale(user_data_ttl):
+            await api.get_user_data()
+            user.first_name = api.first_name
+            user.last_name = api.last_name
+            user.email = api.email
+            user.user_data_updated_at = datetime.now(timezone.utc)
+            await user.update_user_data()
+        else:
+            api.first_name = user.first_name
+            api.last_name = user.last_name
+            api.email = user.email
 
         return api
 
@@ -62,7 +316,78 @@ class HeadHunterAPI:
         return self
 
     async def __aexit__(self, exc_type, exc_value, exc_traceback):
-        await self.session.close()
+        # the shared session outlives API objects
+        pass
+
+    async def _request(self, method: str, path: str, endpoint: str, headers: Dict[str, str] = None) -> APIResponse:
+        """Выполнить запрос к API через общую сессию от имени владельца токена.
+
+        Частота запросов ограничивается `rate_limiter`; на 429 (кроме запрета частой публикации резюме)
+        и 5xx запрос повторяется до `throttle_retries` раз. Таймауты, ошибки соединения и 5xx
+        учитываются общим выключателем `breaker`; пока он разомкнут, запросы не отправляются.
+
+        :param endpoint: название метода API для ограничителя частоты и таймаутов
+        :param headers: дополнительные заголовки запроса
+        :raise HeadHunterRateLimitError: если hh.ru так и не ответил без ограничения частоты
+        :raise HeadHunterUnavailableError: если hh.ru не ответил вовремя, так и не ответил без ошибки сервера
+            или выключатель разомкнут
+        """
+        headers = dict(self.headers, **headers) if headers else self.headers
+        for _ in range(throttle_retries + 1):
+            if not breaker.allow():
+                raise HeadHunterUnavailableError
+            try:
+                await rate_limiter.acquire(self.api_token, endpoint)
+                with bot.metrics.hh_request_duration.time(endpoint=endpoint):
+                    async with get_session().request(
+                            method, f'{self.api_url}{path}', headers=headers, timeout=request_timeout(endpoint)
+                    ) as resp:
+                        response = APIResponse(resp.status, resp.headers, await resp.read())
+            except (asyncio.TimeoutError, ClientError) as e:
+                # a timeout already took its full duration, so don't retry on top of it
+                bot.metrics.hh_responses.inc(endpoint=endpoint, status='error')
+                breaker.on_failure()
+                raise HeadHunterUnavailableError from e
+            except BaseException:
+                # cancelled, or failed on our side: hand back a half-open trial without judging hh.ru
+                breaker.on_cancel()
+                raise
+            bot.metrics.hh_responses.inc(endpoint=endpoint, status=response.status)
+
+            if response.status >= 500:
+                breaker.on_failure()
+            else:
+                breaker.on_success()
+
+            throttled = response.status >= 500 or (
+                response.status == 429 and not response.has_error('touch_limit_exceeded')
+            )
+            if not throttled:
+                rate_limiter.on_success()
+                return response
+
+            retry_after = _retry_after(response.headers)
+            rate_limiter.on_throttle(retry_after.total_seconds() if retry_after else None)
+
+        if response.status >= 500:
+            raise HeadHunterUnavailableError
+        raise HeadHunterRateLimitError
+
+    @staticmethod
+    def _raise_for_status(resp: APIResponse) -> None:
+        """Превратить ответ с ошибкой в исключение; ошибкой авторизации считаются только 401 и 403.
+
+        :raise HeadHunterAuthError: если hh.ru не принял токен
+        :raise HeadHunterRateLimitError: если hh.ru ограничивает частоту запросов
+        :raise HeadHunterUnavailableError: если hh.ru ответил любой другой ошибкой
+        """
+        if resp.status in (401, 403):
+            raise HeadHunterAuthError
+        elif resp.status == 429:
+            raise HeadHunterRateLimitError
+        elif resp.status != 200:
+            # not the token's fault, so it must not count towards the token quarantine
+            raise HeadHunterUnavailableError
 
     async def get_user_data(self) -> None:
         """Метод, получающий данные о пользователе API.
@@ -70,69 +395,172 @@ class HeadHunterAPI:
         См. https://github.com/hhru/api/blob/master/docs/me.md
 
         :raise HeadHunterAuthError: если произошла ошибка авторизации
+        :raise HeadHunterRateLimitError: если hh.ru ограничивает частоту запросов
+        :raise HeadHunterUnavailableError: если hh.ru ответил любой другой ошибкой
         :return: None
         """
-        async with self.session.get(f'{self.api_url}/me') as resp:
-            if resp.status != 200:
-                raise HeadHunterAuthError
-            data = await resp.json()
-            self.first_name = data['first_name']
-            self.last_name = data['last_name']
-            self.email = data['email']
+        resp = await self._request('GET', '/me', 'me')
+        self._raise_for_status(resp)
+        data = resp.json()
+        self.first_name = data['first_name']
+        self.last_name = data['last_name']
+        self.email = data['email']
+
+    async def _get_cached(self, path: str, endpoint: str, parse: Callable[[Any], Any]) -> Any:
+        """GET-запрос через `response_cache`.
+
+        :param parse: функция, строящая значение для кэша из JSON ответа
+        :raise HeadHunterAuthError: если hh.ru не принял токен
+        :raise HeadHunterNotFoundError: если hh.ru ответил 404
+        :raise HeadHunterRateLimitError: если hh.ru ограничивает частоту запросов
+        :raise HeadHunterUnavailableError: если hh.ru ответил любой другой ошибкой
+        :return: значение из кэша или только что полученное; изменять его нельзя
+        """
+        key = (self.api_token, path)
+        cached = response_cache.get(key)
+        if cached is not None and cached.is_fresh:
+            return cached.value
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        resp = await self._request('GET', path, endpoint, headers)
+        if resp.status == 304 and cached is not None:
+            cached.refresh()
+            response_cache.put(key, cached)
+            return cached.value
+        if resp.status == 404:
+            response_cache.invalidate(key)
+            raise HeadHunterNotFoundError
+        self._raise_for_status(resp)
+
+        value = parse(resp.json())
+        response_cache.put(key, CachedResponse(value, resp.headers.get('ETag'), resp.headers.get('Last-Modified')))
+        return value
+
+    def _invalidate_resume(self, resume_id: bot.models.ResumeID) -> None:
+        response_cache.invalidate((self.api_token, f'/resumes/{resume_id}'))
+        response_cache.invalidate((self.api_token, '/resumes/mine'))
 
     async def get_resume(self, resume_id: bot.models.ResumeID) -> bot.models.HeadHunterResume:
-        """
+        """Метод, возвращающий резюме пользователя API (по возможности из `response_cache`).
 
-        :param resume_id:
-        :return:
-        """
-        async with self.session.get(f'{self.api_url}/resumes/{resume_id}') as resp:
-            if resp.status != 200:
-                raise HeadHunterAuthError
-            data = await resp.json()
-
-            return bot.models.HeadHunterResume(
-                resume_id=data['id'],
-                title=data['title'],
-                status=data['status']['id'],
-                access=data['access']['type']['id'],
-                next_publish_at=dateutil.parser.parse(data['next_publish_at'])
-            )
+        См. https://github.com/hhru/api/blob/master/docs/resumes.md#item
 
-    async def get_resume_list(self) -> List[bot.models.HeadHunterResume]:
+        :param resume_id: идентификатор резюме
+        :raise HeadHunterAuthError: если произошла ошибка авторизации
+        :raise HeadHunterNotFoundError: если резюме не найдено
+        :return: копия резюме, которую можно изменять
+        """
+        resume = await self._get_cached(f'/resumes/{resume_id}', 'resume', self._resume_from_data)
+        return copy.copy(resume)
+
+    @staticmethod
+    def _resume_from_data(data: Dict[str, Any]) -> bot.models.HeadHunterResume:
+        return bot.models.HeadHunterResume(
+            resume_id=data['id'],
+            title=data['title'],
+            status=data['status']['id'],
+            access=data['access']['type']['id'],
+            next_publish_at=bot.decoding.parse_timestamp(data['next_publish_at'])
+        )
+
+    async def get_resume_list(
+            self,
+            use_list_payload: bool = True,
+            concurrency: int = None
+    ) -> List[bot.models.HeadHunterResume]:
         """Метод, возвращающий список резюме пользователя API.
 
         См. https://github.com/hhru/api/blob/master/docs/resumes.md#mine
 
+        :param use_list_payload: строить резюме прямо из ответа /resumes/mine, если в нём есть все нужные поля
+        :param concurrency: сколько резюме запрашивать одновременно
         :raise HeadHunterAuthError: если произошла ошибка авторизации
-        :return:
+        :return: список резюме в порядке, в котором их вернул hh.ru; удалённые за это время резюме пропускаются
         """
-        async with self.session.get(f'{self.api_url}/resumes/mine') as resp:
-            if resp.status != 200:
-                raise HeadHunterAuthError
-            data = await resp.json()
-
-            return [
-                await self.get_resume(item['id'])
-                for item in data['items']
-            ]
+        # only the fields HeadHunterResume is built from are kept in the cache
+        items = await self._get_cached(
+            '/resumes/mine', 'resumes_mine',
+            lambda data: [{field: item.get(field) for field in resume_fields} for item in data['items']]
+        )
+
+        semaphore = asyncio.Semaphore(concurrency or resume_fetch_concurrency)
+
+        async def get_resume(item: Dict[str, Any]) -> Optional[bot.models.HeadHunterResume]:
+            if use_list_payload and all(item.get(field) for field in resume_fields):
+                resume = self._resume_from_data(item)
+                # a follow-up activation of this resume doesn't need a request
+                key = (self.api_token, f'/resumes/{resume.resume_id}')
+                if response_cache.get(key) is None:
+                    response_cache.put(key, CachedResponse(resume, None, None))
+                return copy.copy(resume)
+            async with semaphore:
+                try:
+                    return await self.get_resume(item['id'])
+                except HeadHunterNotFoundError:
+                    # deleted after /resumes/mine was cached
+                    return None
+
+        resumes = await asyncio.gather(*(get_resume(item) for item in items))
+        return [resume for resume in resumes if resume is not None]
 
     async def touch_resume(self, resume: bot.models.HeadHunterResume) -> Tuple[bool, bot.models.HeadHunterResume]:
         """Метод, обновляющий время на указанном резюме.
 
+        Время следующей публикации вычисляется локально: после успешной публикации — через `publish_cooldown`,
+        после 429 — по заголовку Retry-After. Резюме запрашивается заново, только если подсказки нет и известное
+        время уже прошло, либо для выборочной сверки (доля `touch_verify_rate`).
+
         См. https://github.com/hhru/api/blob/master/docs/resumes.md#publish
 
         :param resume: резюме для обновления
         :raise HeadHunterAuthError: если произошла ошибка авторизации
+        :raise HeadHunterNotFoundError: если резюме не найдено
         :raise HeadHunterResumeUpdateError: если невозможно опубликовать резюме
-        :return: было ли резюме обновлено и новый объект резюме
+        :raise HeadHunterRateLimitError: если hh.ru ограничивает частоту запросов
+        :return: было ли резюме обновлено и копия резюме с новым временем следующей публикации
         """
-        async with self.session.post(f'{self.api_url}/resumes/{resume.id}/publish') as resp:
-            if resp.status == 403:
-                raise HeadHunterAuthError
-            elif resp.status == 400:
-                raise HeadHunterResumeUpdateError
-            elif resp.status == 429:
-                return False, await self.get_resume(resume.id)
-
-            return True, await self.get_resume(resume.id)
+        resp = await self._request('POST', f'/resumes/{resume.resume_id}/publish', 'publish')
+        self._invalidate_resume(resume.resume_id)
+        if resp.status in (401, 403):
+            raise HeadHunterAuthError
+        elif resp.status == 404:
+            raise HeadHunterNotFoundError
+        elif resp.status == 400:
+            raise HeadHunterResumeUpdateError
+
+        now = datetime.now(timezone.utc)
+        touched = copy.copy(resume)
+        next_publish_at: Optional[datetime]
+
+        if resp.status == 429:
+            has_updated = False
+            retry_after = _retry_after(resp.headers)
+            if retry_after is not None:
+                next_publish_at = now + retry_after
+            elif resume.next_publish_at > now:
+                next_publish_at = resume.next_publish_at
+            else:
+                # we believed the resume was due, so our deadline is wrong
+                next_publish_at = None
+        else:
+            has_updated = True
+            next_publish_at = now + publish_cooldown
+
+        if next_publish_at is None or random.random() < touch_verify_rate:
+            fetched = await self.get_resume(resume.resume_id)
+            if next_publish_at is not None and abs(fetched.next_publish_at - next_publish_at) > touch_verify_tolerance:
+                bot.log.warning(f'Next publish time mismatch for resume {resume.resume_id}: '
+                                f'expected {next_publish_at}, got {fetched.next_publish_at}')
+            touched.title = fetched.title
+            touched.status = fetched.status
+            touched.access = fetched.access
+            next_publish_at = fetched.next_publish_at
+
+        touched.next_publish_at = next_publish_at
+        return has_updated, touched
@@ -0,0 +1,126 @@
+from typing import Dict, Optional, Tuple
+import os
+import re
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+
+log_level: str = os.environ.get('LOG_LEVEL', 'DEBUG').upper()
+"""Уровень логгера бота."""
+
+log_queue: bool = os.environ.get('LOG_QUEUE', '1') != '0'
+"""Писать логи из фонового потока через очередь, чтобы форматирование и запись не блокировали цикл событий."""
+
+log_debug_burst: int = int(os.environ.get('LOG_DEBUG_BURST', 20))
+"""Сколько отладочных строк из одного места в коде пропускать за интервал; остальные отбрасываются."""
+
+log_debug_interval: float = float(os.environ.get('LOG_DEBUG_INTERVAL', 10))
+"""Интервал в секундах, за который считаются отладочные строки из одного места в коде."""
+
+log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+token_pattern = re.compile(r'\b([A-Z0-9]{4})[A-Z0-9]{60}\b')
+"""Токены hh.ru (64 символа A-Z0-9), которые нельзя писать в лог целиком."""
+
+
+def redact(text: str) -> str:
+    """Оставить от токенов hh.ru только первые четыре символа."""
+    return token_pattern.sub(r'\1…', text)
+
+
+class RedactingFormatter(logging.Formatter):
+    """Форматтер, который прячет токены и дописывает, сколько похожих строк было отброшено."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            text = f'{text} [{suppressed} similar lines suppressed]'
+        return redact(text)
+
+
+class DebugSampler(logging.Filter):
+    """Пропускает не больше `burst` отладочных строк из одного места в коде за `interval` секунд.
+
+    Отброшенная строка ничего не стоит, только если сообщение передано шаблоном с аргументами
+    в стиле %, а не f-строкой. Строки уровня INFO и выше пропускаются всегда."""
+
+    burst: int
+    interval: float
+
+    def __init__(self, burst: int, interval: float):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            # window: [started_at, passed, suppressed]
+            if window is not None and window[2]:
+                record.suppressed = window[2]
+            self._windows[key] = [now, 1, 0]
+            return True
+
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который кладёт запись в очередь как есть, без форматирования.
+
+    Стандартный QueueHandler форматирует сообщение в вызывающем потоке, чтобы запись можно было
+    передать в другой процесс; здесь очередь внутри процесса, поэтому шаблон и аргументы
+    подставляются уже в потоке записи. Аргументы не должны меняться после вызова логгера."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(logger: logging.Logger) -> None:
+    """Настроить логгер бота: один обработчик в stderr, в фоновом потоке, если включён `log_queue`.
+
+    Повторный вызов ничего не делает."""
+    global _listener
+
+    if logger.handlers:
+        return
+
+    logger.setLevel(log_level)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(RedactingFormatter(log_format))
+
+    if log_queue:
+        handler: logging.Handler = LazyQueueHandler(queue.Queue())
+        _listener = logging.handlers.QueueListener(handler.queue, stream_handler)
+        _listener.start()
+        atexit.register(stop_logging)
+    else:
+        handler = stream_handler
+
+    handler.addFilter(DebugSampler(log_debug_burst, log_debug_interval))
+    logger.addHandler(handler)
+
+
+def stop_logging() -> None:
+    """Дописать записи, оставшиеся в очереди, и остановить фоновый поток."""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
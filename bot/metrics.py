@@ -0,0 +1,220 @@
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from contextlib import contextmanager
+import time
+import bisect
+import logging
+from aiohttp import web
+
+log = logging.getLogger('hh-update-bot')
+
+LabelValues = Tuple[str, ...]
+
+default_buckets: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+"""Границы корзин гистограмм по умолчанию, в секундах."""
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Метрика с набором меток; значения для каждого сочетания меток хранятся отдельно."""
+
+    kind: str = 'untyped'
+    name: str
+    help: str
+    label_names: Tuple[str, ...]
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """Строки значений: имя, метки, значение."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.label_names, key), value
+
+
+class Gauge(Metric):
+    """Значение, которое может как расти, так и уменьшаться."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.label_names, key), value
+
+
+class Histogram(Metric):
+    """Распределение значений (обычно длительностей) по корзинам."""
+
+    kind = 'histogram'
+    buckets: Tuple[float, ...]
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = None):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets or default_buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Замерить длительность блока `with`, в том числе с `await` внутри."""
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started_at, **labels)
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        label_names = self.label_names + ('le',)
+        for key, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', _format_labels(label_names, key + (_format_value(bound),)), cumulative
+            yield f'{self.name}_sum', _format_labels(self.label_names, key), self._sums[key]
+            yield f'{self.name}_count', _format_labels(self.label_names, key), cumulative
+
+
+registry: List[Metric] = []
+"""Все метрики процесса, в порядке создания."""
+
+collectors: List[Callable[[], None]] = []
+"""Функции, обновляющие метрики перед каждой выдачей (например, копирующие счётчики из статистики)."""
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    for collect in collectors:
+        try:
+            collect()
+        except Exception:
+            log.exception('Metrics: collector failed')
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', headers={'X-Content-Type-Options': 'nosniff'})
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def start_server(host: str, port: int) -> None:
+    """Отдавать метрики по HTTP на `host:port` по адресу /metrics."""
+    global _runner
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    log.info(f'Metrics: listening on {host}:{port}/metrics')
+
+
+async def stop_server() -> None:
+    global _runner
+
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
+
+
+# hh.ru API
+hh_request_duration = Histogram('hh_request_duration_seconds', 'Duration of hh.ru API requests.', ['endpoint'])
+hh_responses = Counter('hh_responses_total', 'hh.ru API responses by status code.', ['endpoint', 'status'])
+
+# PostgreSQL
+db_pool_acquire_duration = Histogram('db_pool_acquire_seconds', 'Time spent waiting for a pool connection.')
+db_query_duration = Histogram('db_query_duration_seconds', 'Duration of database queries.', ['query'])
+db_query_errors = Counter('db_query_errors_total', 'Database queries that raised an error.', ['query'])
+
+# Telegram
+chat_command_duration = Histogram('chat_command_duration_seconds', 'Time to handle a chat message.', ['command'])
+
+# resume toucher
+touch_pass_duration = Histogram(
+    'touch_pass_duration_seconds', 'Duration of a touch pass.',
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+)
+touch_resumes = Counter('touch_resumes_total', 'Resumes processed by touch passes by outcome.', ['outcome'])
+touch_plan_rate = Gauge('touch_plan_rate', 'Planned touches per second in the loaded window: mean or peak.', ['stat'])
+touch_plan_peak_to_mean = Gauge('touch_plan_peak_to_mean', 'Peak to mean ratio of planned touches; 1 is flat.')
+touch_plan_cv = Gauge('touch_plan_cv', 'Coefficient of variation of planned touches per bucket; 0 is flat.')
+
+# counters kept by other modules, copied by collectors on every scrape
+cache_entries = Gauge('cache_entries', 'Entries in an in-process cache.', ['cache'])
+cache_hits = Gauge('cache_hits', 'Cache hits since start.', ['cache'])
+cache_misses = Gauge('cache_misses', 'Cache misses since start.', ['cache'])
+outbox_queue_length = Gauge('outbox_queue_length', 'Telegram messages waiting to be sent.')
+outbox_messages = Gauge('outbox_messages', 'Telegram messages since start by state.', ['state'])
+hh_connections = Gauge('hh_connections', 'hh.ru connections since start: created or reused.', ['state'])
+hh_rate_limit = Gauge('hh_rate_limit', 'Current global hh.ru request rate limit, requests per second.')
+hh_rate_limiter = Gauge('hh_rate_limiter', 'hh.ru rate limiter counters since start.', ['stat'])
+hh_circuit_state = Gauge('hh_circuit_state', 'hh.ru circuit breaker state: 0 closed, 1 half-open, 2 open.')
+hh_circuit_breaker = Gauge('hh_circuit_breaker', 'hh.ru circuit breaker counters since start.', ['stat'])
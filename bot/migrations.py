@@ -0,0 +1,154 @@
+from typing import List, Tuple
+import bot
+from bot.models import Transaction
+
+Migration = Tuple[int, str, str]
+"""Миграция схемы БД: номер версии, описание и SQL."""
+
+migrations: List[Migration] = [
+    (
+        1,
+        'Create user and resume tables',
+        """
+        CREATE TABLE IF NOT EXISTS public."user"
+        (
+            user_id bigint NOT NULL,
+            hh_token character varying(64) COLLATE pg_catalog."default",
+            first_name character varying(64) COLLATE pg_catalog."default",
+            last_name character varying(64) COLLATE pg_catalog."default",
+            email character varying(64) COLLATE pg_catalog."default",
+            is_waiting_for_token boolean NOT NULL DEFAULT true,
+            CONSTRAINT user_pkey PRIMARY KEY (user_id)
+        )
+        WITH (
+            OIDS = FALSE
+        )
+        TABLESPACE pg_default;
+
+        ALTER TABLE public."user"
+            OWNER to postgres;
+
+        CREATE TABLE IF NOT EXISTS public.resume
+        (
+            resume_id character varying(64) COLLATE pg_catalog."default" NOT NULL,
+            user_id bigint NOT NULL,
+            title character varying(128) COLLATE pg_catalog."default" NOT NULL,
+            status character varying(64) COLLATE pg_catalog."default" NOT NULL,
+            next_publish_at timestamp with time zone NOT NULL,
+            access character varying(64) COLLATE pg_catalog."default" NOT NULL,
+            is_active boolean NOT NULL DEFAULT false,
+            until timestamp with time zone NOT NULL,
+            CONSTRAINT resume_pkey PRIMARY KEY (resume_id),
+            CONSTRAINT fk_resume_user_id FOREIGN KEY (user_id)
+                REFERENCES public."user" (user_id) MATCH SIMPLE
+                ON UPDATE NO ACTION
+                ON DELETE CASCADE
+        )
+        WITH (
+            OIDS = FALSE
+        )
+        TABLESPACE pg_default;
+
+        ALTER TABLE public.resume
+            OWNER to postgres;
+        """
+    ),
+    (
+        2,
+        'Add user.user_data_updated_at',
+        """
+        ALTER TABLE public."user"
+            ADD COLUMN IF NOT EXISTS user_data_updated_at timestamp with time zone;
+        """
+    ),
+    (
+        3,
+        'Index active resumes by next_publish_at and resumes by user_id',
+        """
+        CREATE INDEX IF NOT EXISTS resume_active_next_publish_at_idx
+            ON public.resume (next_publish_at)
+            WHERE is_active;
+
+        CREATE INDEX IF NOT EXISTS resume_user_id_idx
+            ON public.resume (user_id);
+        """
+    ),
+    (
+        4,
+        'Add resume lease columns for multi-node touching',
+        """
+        ALTER TABLE public.resume
+            ADD COLUMN IF NOT EXISTS lease_owner character varying(64) COLLATE pg_catalog."default",
+            ADD COLUMN IF NOT EXISTS lease_until timestamp with time zone;
+
+        CREATE INDEX IF NOT EXISTS resume_lease_owner_idx
+            ON public.resume (lease_owner)
+            WHERE lease_owner IS NOT NULL;
+        """
+    ),
+    (
+        5,
+        'Index active resumes by until',
+        """
+        CREATE INDEX IF NOT EXISTS resume_active_until_idx
+            ON public.resume (until)
+            WHERE is_active;
+        """
+    ),
+    (
+        6,
+        'Add token health columns to users',
+        """
+        ALTER TABLE public."user"
+            ADD COLUMN IF NOT EXISTS auth_failures integer NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS token_quarantined_at timestamp with time zone;
+
+        CREATE INDEX IF NOT EXISTS user_quarantined_idx
+            ON public."user" (user_id)
+            WHERE token_quarantined_at IS NOT NULL;
+        """
+    ),
+]
+
+migration_lock_id = 0x6868  # 'hh'
+"""Ключ advisory-блокировки, чтобы несколько процессов не применяли миграции одновременно."""
+
+
+async def migrate() -> None:
+    """Применить к БД все ещё не применённые миграции, каждую в своей транзакции."""
+    async with bot.pg_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS public.schema_migration
+                (
+                    version integer NOT NULL,
+                    description text NOT NULL,
+                    applied_at timestamp with time zone NOT NULL DEFAULT now(),
+                    CONSTRAINT schema_migration_pkey PRIMARY KEY (version)
+                );
+                """
+            )
+
+            for version, description, sql in migrations:
+                async with Transaction(cur):
+                    await cur.execute('SELECT pg_advisory_xact_lock(%(lock_id)s);', {'lock_id': migration_lock_id})
+                    await cur.execute(
+                        'SELECT 1 FROM public.schema_migration WHERE version = %(version)s;',
+                        {'version': version}
+                    )
+                    if await cur.fetchone():
+                        continue
+
+                    bot.log.info(f'Migrations: Applying {version} ({description})...')
+                    await cur.execute(sql)
+                    await cur.execute(
+                        """
+                        INSERT INTO
+                            public.schema_migration
+                            (version, description)
+                        VALUES
+                            (%(version)s, %(description)s);
+                        """,
+                        {'version': version, 'description': description}
+                    )
@@ -1,6 +1,15 @@
-from typing import List, Optional, Dict, Union
-from datetime import datetime, timedelta
+from typing import Any, AsyncGenerator, Awaitable, Callable, List, Optional, Dict, Tuple, Union
+from datetime import datetime, timedelta, timezone
+import os
+import sys
+import copy
+import time
+import uuid
+import asyncio
 import bot
+import bot.metrics
+from bot.cache import TTLCache
+from bot.repository import Statement
 
 ResumeID = str
 """Идентификатор резюме на hh.ru."""
@@ -8,10 +17,128 @@ ResumeID = str
 UserID = int
 """Идентификатор пользователя Telegram."""
 
+RESUME_CHANNEL = 'resume_changes'
+"""Канал уведомлений PostgreSQL об активации и деактивации резюме; в payload — идентификатор резюме."""
+
+USER_CHANNEL = 'user_changes'
+"""Канал уведомлений PostgreSQL об изменении пользователя; payload — `<process_id>:<user_id>`."""
+
+UserResumes = Tuple['TelegramUser', List['HeadHunterResume']]
+"""Пользователь и его резюме."""
+
+AUTH_FAILURE_COUNTED = 'counted'
+"""Ошибка авторизации учтена, токен пока не в карантине (или уже был в нём)."""
+
+TOKEN_QUARANTINED = 'quarantined'
+"""Ошибка авторизации учтена, и токен только что помещён в карантин."""
+
+TOKEN_CHANGED = 'token_changed'
+"""Ошибка не учтена: пользователь уже сменил токен, и объект пользователя устарел."""
+
+db_read_batch_size: int = int(os.environ.get('DB_READ_BATCH_SIZE', 1000))
+"""Сколько строк читать из серверного курсора за раз."""
+
+process_id: str = uuid.uuid4().hex
+"""Идентификатор процесса, чтобы не сбрасывать кэш из-за собственных уведомлений."""
+
+user_cache: 'TTLCache[UserID, TelegramUser]' = TTLCache(
+    max_size=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 300))
+)
+"""Кэш пользователей со сквозной записью; между процессами согласуется через `USER_CHANNEL`."""
+
+
+class Transaction:
+    """Явная транзакция на курсоре aiopg.
+
+    Соединения aiopg работают в режиме autocommit, поэтому транзакцию открываем и закрываем сами."""
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    async def __aenter__(self):
+        await self.cur.execute('BEGIN;')
+        return self.cur
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.cur.execute('COMMIT;' if exc_type is None else 'ROLLBACK;')
+
+
+class Cursor:
+    """Курсор на соединении из пула, с замером ожидания соединения и длительности запроса.
+
+    :param query: название запроса для метрик
+    """
+
+    query: str
+
+    def __init__(self, query: str):
+        self.query = query
+
+    async def __aenter__(self):
+        started_at = time.monotonic()
+        self._acquire = bot.pg_pool.acquire()
+        conn = await self._acquire.__aenter__()
+        bot.metrics.db_pool_acquire_duration.observe(time.monotonic() - started_at)
+        try:
+            self._cursor = conn.cursor()
+            cur = await self._cursor.__aenter__()
+        except BaseException:
+            await self._acquire.__aexit__(*sys.exc_info())
+            raise
+        self._started_at = time.monotonic()
+        return cur
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        bot.metrics.db_query_duration.observe(time.monotonic() - self._started_at, query=self.query)
+        if exc_type is not None:
+            bot.metrics.db_query_errors.inc(query=self.query)
+        try:
+            await self._cursor.__aexit__(exc_type, exc_value, exc_traceback)
+        finally:
+            await self._acquire.__aexit__(exc_type, exc_value, exc_traceback)
+
+
+async def notify(channel: str, payload: str) -> None:
+    """Отправить уведомление всем процессам, слушающим канал."""
+    async with Cursor('notify') as cur:
+        await cur.execute(
+            "SELECT pg_notify(%(channel)s, %(payload)s);",
+            {'channel': channel, 'payload': payload}
+        )
+
+
+async def listen(channel: str, handler: Callable[[str], Awaitable[None]]) -> None:
+    """Слушать канал уведомлений и передавать payload каждого уведомления в `handler`.
+
+    Занимает одно соединение из пула на всё время работы. Перед возвратом в пул соединение
+    отписывается от канала, а если отписаться не удалось, закрывается.
+    """
+    async with bot.pg_pool.acquire() as conn:
+        try:
+            async with conn.cursor() as cur:
+                bot.log.info(f"Models: Listening to channel '{channel}'...")
+                await cur.execute(f'LISTEN {channel};')
+            while True:
+                msg = await conn.notifies.get()
+                await handler(msg.payload)
+        finally:
+            try:
+                async with conn.cursor() as cur:
+                    await cur.execute('UNLISTEN *;')
+                # drop what arrived before UNLISTEN, so the next user of the connection doesn't get it
+                while not conn.notifies.empty():
+                    conn.notifies.get_nowait()
+            except BaseException:
+                bot.log.exception(f"Models: Failed to stop listening to channel '{channel}', closing the connection")
+                conn.close()
+
 
 class HeadHunterResume:
     """Резюме на hh.ru."""
 
+    __slots__ = ('resume_id', 'title', 'status', 'next_publish_at', 'access', 'user_id', 'is_active', 'until')
+
     resume_id: ResumeID
     """Идентификатор резюме."""
 
@@ -27,13 +154,13 @@ class HeadHunterResume:
     access: str
     """Доступ к резюме для других пользователей hh.ru."""
 
-    user_id: UserID = None
+    user_id: UserID
     """Идентификатор пользователя."""
 
-    is_active: bool = False
+    is_active: bool
     """Активно ли резюме."""
 
-    until: datetime = None
+    until: datetime
     """До какого срока активно резюме."""
 
     def __init__(
@@ -68,206 +195,508 @@ class HeadHunterResume:
             until=self.until
         )
 
-    @staticmethod
-    async def create_table() -> None:
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                bot.log.info("Models: Creating table 'public.resume'...")
-                await cur.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS public.resume
-                    (
-                        resume_id character varying(64) COLLATE pg_catalog."default" NOT NULL,
-                        user_id bigint NOT NULL,
-                        title character varying(128) COLLATE pg_catalog."default" NOT NULL,
-                        status character varying(64) COLLATE pg_catalog."default" NOT NULL,
-                        next_publish_at timestamp with time zone NOT NULL,
-                        access character varying(64) COLLATE pg_catalog."default" NOT NULL,
-                        is_active boolean NOT NULL DEFAULT false,
-                        until timestamp with time zone NOT NULL,
-                        CONSTRAINT resume_pkey PRIMARY KEY (resume_id),
-                        CONSTRAINT fk_resume_user_id FOREIGN KEY (user_id)
-                            REFERENCES public."user" (user_id) MATCH SIMPLE
-                            ON UPDATE NO ACTION
-                            ON DELETE CASCADE
-                    )
-                    WITH (
-                        OIDS = FALSE
-                    )
-                    TABLESPACE pg_default;
-
-                    ALTER TABLE public.resume
-                        OWNER to postgres;
-                    """
-                )
+    _create = Statement(
+        'resume_create',
+        """
+        INSERT INTO
+            public.resume
+            (resume_id, title, status, next_publish_at, access, user_id, is_active, until)
+        VALUES
+            (
+                %(resume_id)s,
+                %(title)s,
+                %(status)s,
+                %(next_publish_at)s,
+                %(access)s,
+                %(user_id)s,
+                %(is_active)s,
+                %(until)s
+            );
+        """
+    )
 
     async def create(self) -> None:
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                bot.log.info(f"Models: Inserting resume {self.resume_id}...")
+        async with Cursor('resume.create') as cur:
+            bot.log.debug('Models: Inserting resume %s...', self.resume_id)
+            await HeadHunterResume._create.execute(cur, self.as_dict())
 
-                await cur.execute(
-                    """
-                    INSERT INTO
-                        public.resume
-                        (resume_id, title, status, next_publish_at, access, user_id, is_active, until)
-                    VALUES
-                        (
-                            %(resume_id)s,
-                            %(title)s,
-                            %(status)s,
-                            %(next_publish_at)s,
-                            %(access)s,
-                            %(user_id)s,
-                            %(is_active)s,
-                            %(until)s
-                        );
-                    """,
-                    self.as_dict()
-                )
+    _get = Statement(
+        'resume_get',
+        """
+        SELECT
+            resume_id,
+            user_id,
+            title,
+            status,
+            next_publish_at,
+            access,
+            is_active,
+            until
+        FROM
+            public.resume
+        WHERE
+            resume_id = %(resume_id)s;
+        """
+    )
 
     @staticmethod
     async def get(resume_id: ResumeID) -> Optional['HeadHunterResume']:
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                bot.log.info(f'Models: Getting resume with id {resume_id}...')
-                await cur.execute(
-                    """
-                    SELECT
-                        resume_id,
-                        user_id,
-                        title,
-                        status,
-                        next_publish_at,
-                        access,
-                        is_active,
-                        until
-                    FROM
-                        public.resume
-                    WHERE
-                        resume_id = %(resume_id)s;
-                    """,
-                    {'resume_id': resume_id}
-                )
-                resume = await cur.fetchone()
-                if not resume:
-                    return None
-                return HeadHunterResume(
-                    resume_id=resume[0],
-                    user_id=resume[1],
-                    title=resume[2],
-                    status=resume[3],
-                    next_publish_at=resume[4],
-                    access=resume[5],
-                    is_active=resume[6],
-                    until=resume[7]
-                )
+        async with Cursor('resume.get') as cur:
+            bot.log.debug('Models: Getting resume with id %s...', resume_id)
+            return await HeadHunterResume._get.fetch_one(cur, HeadHunterResume, {'resume_id': resume_id})
+
+    _update = Statement(
+        'resume_update',
+        """
+        UPDATE
+            public.resume
+        SET
+            user_id=%(user_id)s,
+            title=%(title)s,
+            status=%(status)s,
+            next_publish_at=%(next_publish_at)s,
+            access=%(access)s,
+            is_active=%(is_active)s,
+            until=%(until)s
+        WHERE
+            resume_id = %(resume_id)s;
+        """
+    )
 
     async def update(self) -> None:
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                bot.log.info(f'Models: Updating resume with id {self.resume_id}...')
-                await cur.execute(
-                    """
-                    UPDATE
-                        public.resume
-                    SET
-                        user_id=%(user_id)s,
-                        title=%(title)s,
-                        status=%(status)s,
-                        next_publish_at=%(next_publish_at)s,
-                        access=%(access)s,
-                        is_active=%(is_active)s,
-                        until=%(until)s
-                    WHERE
-                        resume_id = %(resume_id)s;
-                    """,
-                    self.as_dict()
-                )
+        async with Cursor('resume.update') as cur:
+            bot.log.debug('Models: Updating resume with id %s...', self.resume_id)
+            await HeadHunterResume._update.execute(cur, self.as_dict())
+
+    _upsert = Statement(
+        'resume_upsert',
+        """
+        INSERT INTO
+            public.resume
+            (resume_id, title, status, next_publish_at, access, user_id, is_active, until)
+        VALUES
+            (
+                %(resume_id)s,
+                %(title)s,
+                %(status)s,
+                %(next_publish_at)s,
+                %(access)s,
+                %(user_id)s,
+                %(is_active)s,
+                %(until)s
+            )
+        ON CONFLICT (resume_id) DO UPDATE SET
+            user_id=EXCLUDED.user_id,
+            title=EXCLUDED.title,
+            status=EXCLUDED.status,
+            next_publish_at=EXCLUDED.next_publish_at,
+            access=EXCLUDED.access,
+            is_active=EXCLUDED.is_active,
+            until=EXCLUDED.until;
+        """
+    )
 
     async def upsert(self) -> None:
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                bot.log.info(f'Models: Inserting or updating resume with id {self.resume_id}...')
-                await cur.execute(
-                    """
+        async with Cursor('resume.upsert') as cur:
+            bot.log.debug('Models: Inserting or updating resume with id %s...', self.resume_id)
+            await HeadHunterResume._upsert.execute(cur, self.as_dict())
+
+    @staticmethod
+    async def sync_user_resumes(user_id: UserID, resumes: List['HeadHunterResume']) -> List[ResumeID]:
+        """Привести резюме пользователя в БД в соответствие с полным списком его резюме на hh.ru.
+
+        Одним запросом: новые резюме добавляются неактивными, у известных обновляются данные с hh.ru
+        (активность не меняется), а резюме, которых на hh.ru больше нет, деактивируются
+        с уведомлением в `RESUME_CHANNEL`.
+
+        :param user_id: идентификатор пользователя
+        :param resumes: все резюме пользователя на hh.ru
+        :return: идентификаторы деактивированных резюме
+        """
+        params: Dict[str, Any] = {
+            'user_id': user_id,
+            'resume_ids': [r.resume_id for r in resumes],
+            'channel': RESUME_CHANNEL,
+        }
+
+        synced = ''
+        if resumes:
+            values = ', '.join(
+                f'(%(resume_id_{n})s, %(user_id)s, %(title_{n})s, %(status_{n})s, '
+                f'%(next_publish_at_{n})s, %(access_{n})s, false, now())'
+                for n in range(len(resumes))
+            )
+            for n, r in enumerate(resumes):
+                params.update({
+                    f'resume_id_{n}': r.resume_id,
+                    f'title_{n}': r.title,
+                    f'status_{n}': r.status,
+                    f'next_publish_at_{n}': r.next_publish_at,
+                    f'access_{n}': r.access,
+                })
+            synced = f"""
+                synced AS (
+                    INSERT INTO
+                        public.resume
+                        (resume_id, user_id, title, status, next_publish_at, access, is_active, until)
+                    VALUES
+                        {values}
+                    ON CONFLICT (resume_id) DO UPDATE SET
+                        user_id=EXCLUDED.user_id,
+                        title=EXCLUDED.title,
+                        status=EXCLUDED.status,
+                        next_publish_at=EXCLUDED.next_publish_at,
+                        access=EXCLUDED.access
+                ),"""
+
+        async with Cursor('resume.sync_user_resumes') as cur:
+            bot.log.debug('Models: Synchronizing %s resumes of user %s...', len(resumes), user_id)
+            await cur.execute(
+                f"""
+                WITH{synced}
+                gone AS (
                     UPDATE
                         public.resume
                     SET
-                        user_id=%(user_id)s,
-                        title=%(title)s,
-                        status=%(status)s,
-                        next_publish_at=%(next_publish_at)s,
-                        access=%(access)s,
-                        is_active=%(is_active)s,
-                        until=%(until)s
-                    WHERE resume_id=%(resume_id)s;
-                    
-                    INSERT INTO
-                        public.resume
-                        (resume_id, title, status, next_publish_at, access, user_id, is_active, until)
-                        SELECT
-                            %(resume_id)s,
-                            %(title)s,
-                            %(status)s,
-                            %(next_publish_at)s,
-                            %(access)s,
-                            %(user_id)s,
-                            %(is_active)s,
-                            %(until)s
-                        WHERE NOT EXISTS (
-                            SELECT
-                                1
-                            FROM
-                                public.resume
-                            WHERE
-                                resume_id=%(resume_id)s
-                        );
-                    """,
-                    self.as_dict()
+                        is_active=false
+                    WHERE
+                        user_id = %(user_id)s
+                        AND is_active
+                        AND resume_id <> ALL(%(resume_ids)s::varchar[])
+                    RETURNING
+                        resume_id
                 )
+                SELECT
+                    resume_id,
+                    pg_notify(%(channel)s, resume_id)
+                FROM
+                    gone;
+                """,
+                params
+            )
+            return [r[0] for r in await cur.fetchall()]
+
+    @staticmethod
+    async def update_many(resumes: List['HeadHunterResume']) -> None:
+        """Сохранить данные с hh.ru сразу нескольких резюме одним запросом.
+
+        Активность резюме не записывается: пока запись ждала в буфере, резюме могли выключить."""
+        if not resumes:
+            return
+
+        values = ', '.join('(%s, %s, %s, %s::timestamptz, %s)' for _ in resumes)
+        params: List[Any] = []
+        for r in resumes:
+            params.extend((r.resume_id, r.title, r.status, r.next_publish_at, r.access))
+
+        async with Cursor('resume.update_many') as cur:
+            bot.log.debug('Models: Updating %s resumes...', len(resumes))
+            await cur.execute(
+                f"""
+                UPDATE
+                    public.resume AS r
+                SET
+                    title=v.title,
+                    status=v.status,
+                    next_publish_at=v.next_publish_at,
+                    access=v.access
+                FROM
+                    (VALUES {values}) AS v (resume_id, title, status, next_publish_at, access)
+                WHERE
+                    r.resume_id = v.resume_id;
+                """,
+                params
+            )
 
     async def activate(self) -> None:
-        bot.log.info(f'Models: Activating resume with id {self.resume_id}...')
+        bot.log.debug('Models: Activating resume with id %s...', self.resume_id)
         self.is_active = True
         self.until = datetime.now() + timedelta(days=7)
         await self.upsert()
+        await notify(RESUME_CHANNEL, self.resume_id)
 
     async def deactivate(self) -> None:
-        bot.log.info(f'Models: Deactivating resume with id {self.resume_id}...')
+        bot.log.debug('Models: Deactivating resume with id %s...', self.resume_id)
         self.is_active = False
         await self.update()
+        await notify(RESUME_CHANNEL, self.resume_id)
+
+    _get_user_active_resume_list = Statement(
+        'resume_get_user_active_resume_list',
+        """
+        SELECT
+            resume_id,
+            user_id,
+            title,
+            status,
+            next_publish_at,
+            access,
+            is_active,
+            until
+        FROM
+            public.resume
+        WHERE
+            user_id=%(user_id)s AND
+            is_active;
+        """
+    )
 
     @staticmethod
     async def get_user_active_resume_list(user: 'TelegramUser') -> List['HeadHunterResume']:
         assert user.user_id
 
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
+        async with Cursor('resume.get_user_active_resume_list') as cur:
+            return await HeadHunterResume._get_user_active_resume_list.fetch_all(
+                cur, HeadHunterResume, {'user_id': user.user_id}
+            )
+
+    @staticmethod
+    def _active_resume_query(due_after: Optional[datetime], due_before: Optional[datetime]) -> str:
+        """Запрос активных резюме с владельцами, упорядоченных по пользователям; без точки с запятой."""
+        # both bounds go through the partial index on next_publish_at
+        window = ''
+        if due_after is not None:
+            window += ' AND public.resume.next_publish_at > %(due_after)s'
+        if due_before is not None:
+            window += ' AND public.resume.next_publish_at <= %(due_before)s'
+
+        return f"""
+            SELECT
+                public.resume.resume_id,  -- 0
+                public.resume.title,      -- 1
+                public.resume.status,     -- 2
+                public.resume.next_publish_at,  -- 3
+                public.resume.access,     -- 4
+                public.resume.until,      -- 5
+                public.user.user_id,      -- 6
+                public.user.hh_token,     -- 7
+                public.user.user_data_updated_at,  -- 8
+                public.user.auth_failures  -- 9
+            FROM
+                public.resume
+            JOIN
+                public.user ON public.user.user_id = public.resume.user_id
+            WHERE
+                is_active
+                AND public.resume.until >= now()
+                AND public.user.token_quarantined_at IS NULL{window}
+            ORDER BY
+                public.resume.user_id
+            """
+
+    @staticmethod
+    async def iter_active_resumes(
+            due_after: datetime = None,
+            due_before: datetime = None,
+            batch_size: int = None
+    ) -> AsyncGenerator[List[UserResumes], None]:
+        """Читать активные резюме серверным курсором и отдавать их пачками по мере чтения.
+
+        В пачке — пользователи со всеми их активными резюме; объект пользователя один на все его резюме,
+        и резюме одного пользователя никогда не разбиваются между пачками. Пока идёт чтение, занято
+        одно соединение из пула с открытой транзакцией.
+
+        :param due_after: только резюме, которые можно поднять позже этого времени
+        :param due_before: только резюме, которые можно поднять не позже этого времени
+        :param batch_size: сколько строк читать за раз
+        """
+        batch_size = batch_size or db_read_batch_size
+
+        async with Cursor('resume.iter_active_resumes') as cur:
+            async with Transaction(cur):
+                bot.log.info('Models: Streaming active resume list...')
                 await cur.execute(
-                    """
-                    SELECT
-                        resume_id,
-                        user_id,
-                        title,
-                        status,
-                        next_publish_at,
-                        access,
-                        is_active,
-                        until
-                    FROM
+                    'DECLARE active_resumes NO SCROLL CURSOR FOR '
+                    + HeadHunterResume._active_resume_query(due_after, due_before) + ';',
+                    {'due_after': due_after, 'due_before': due_before}
+                )
+
+                # the last user of a batch may have more resumes in the next one
+                pending: Optional[UserResumes] = None
+                while True:
+                    await cur.execute('FETCH %(batch_size)s FROM active_resumes;', {'batch_size': batch_size})
+                    rows = await cur.fetchall()
+                    if not rows:
+                        break
+
+                    batch: List[UserResumes] = []
+                    for r in rows:
+                        if pending is None or pending[0].user_id != r[6]:
+                            if pending is not None:
+                                batch.append(pending)
+                            pending = (HeadHunterResume._user_from_row(r), [])
+                        pending[1].append(HeadHunterResume._resume_from_row(r))
+                    if batch:
+                        yield batch
+
+                if pending is not None:
+                    yield [pending]
+
+                await cur.execute('CLOSE active_resumes;')
+
+    @staticmethod
+    def _resume_from_row(r: Tuple) -> 'HeadHunterResume':
+        return HeadHunterResume(
+            resume_id=r[0],
+            title=r[1],
+            status=r[2],
+            next_publish_at=r[3],
+            access=r[4],
+            user_id=r[6],
+            is_active=True,
+            until=r[5]
+        )
+
+    @staticmethod
+    def _user_from_row(r: Tuple) -> 'TelegramUser':
+        return TelegramUser(
+            user_id=r[6],
+            hh_token=r[7],
+            user_data_updated_at=r[8],
+            auth_failures=r[9]
+        )
+
+    @staticmethod
+    def _group_by_user(
+            rows: List[Tuple]
+    ) -> Dict[UserID, List[Dict[str, Union['HeadHunterResume', 'TelegramUser']]]]:
+        """Сгруппировать по пользователям строки (resume_id, title, status, next_publish_at, access, until,
+        user_id, hh_token, user_data_updated_at, auth_failures); объект пользователя один на все его резюме."""
+        resumes_and_users = {}
+        users: Dict[UserID, TelegramUser] = {}
+
+        for r in rows:
+            user_id = r[6]
+            if user_id not in resumes_and_users:
+                resumes_and_users[user_id] = []
+                users[user_id] = HeadHunterResume._user_from_row(r)
+
+            resumes_and_users[user_id].append(
+                {
+                    'resume': HeadHunterResume._resume_from_row(r),
+                    'user': users[user_id]
+                }
+            )
+
+        return resumes_and_users
+
+    @staticmethod
+    async def claim_due(
+            owner: str,
+            limit: int,
+            lease_seconds: float
+    ) -> Dict[UserID, List[Dict[str, Union['HeadHunterResume', 'TelegramUser']]]]:
+        """Захватить до `limit` активных резюме, которые пора поднимать, и взять на них аренду.
+
+        Строки, заблокированные другими воркерами, пропускаются (`SKIP LOCKED`), а резюме с ещё
+        не истёкшей арендой не захватываются, поэтому каждое резюме обрабатывает только один воркер.
+        Если воркер упал, его резюме захватит другой после истечения аренды. Резюме пользователей
+        с токеном в карантине не захватываются.
+
+        :param owner: идентификатор воркера
+        :param limit: максимальное количество резюме
+        :param lease_seconds: длительность аренды в секундах
+        """
+        async with Cursor('resume.claim_due') as cur:
+            await cur.execute(
+                """
+                UPDATE
+                    public.resume AS r
+                SET
+                    lease_owner = %(owner)s,
+                    lease_until = now() + %(lease_seconds)s * interval '1 second'
+                FROM
+                    (
+                        SELECT
+                            resume_id
+                        FROM
+                            public.resume
+                        WHERE
+                            is_active
+                            AND next_publish_at <= now()
+                            AND until >= now()
+                            AND (lease_until IS NULL OR lease_until < now())
+                            AND NOT EXISTS (
+                                SELECT
+                                    1
+                                FROM
+                                    public.user AS q
+                                WHERE
+                                    q.user_id = public.resume.user_id
+                                    AND q.token_quarantined_at IS NOT NULL
+                            )
+                        ORDER BY
+                            next_publish_at
+                        LIMIT
+                            %(limit)s
+                        FOR UPDATE SKIP LOCKED
+                    ) AS due,
+                    public.user AS u
+                WHERE
+                    r.resume_id = due.resume_id
+                    AND u.user_id = r.user_id
+                RETURNING
+                    r.resume_id,  -- 0
+                    r.title,      -- 1
+                    r.status,     -- 2
+                    r.next_publish_at,  -- 3
+                    r.access,     -- 4
+                    r.until,      -- 5
+                    u.user_id,    -- 6
+                    u.hh_token,   -- 7
+                    u.user_data_updated_at,  -- 8
+                    u.auth_failures;  -- 9
+                """,
+                {'owner': owner, 'limit': limit, 'lease_seconds': lease_seconds}
+            )
+            rows = await cur.fetchall()
+            if rows:
+                bot.log.debug('Models: %s claimed %s resumes', owner, len(rows))
+            return HeadHunterResume._group_by_user(rows)
+
+    @staticmethod
+    async def deactivate_expired() -> Dict[UserID, List['HeadHunterResume']]:
+        """Деактивировать одним запросом все активные резюме, срок продвижения которых истёк.
+
+        О каждом деактивированном резюме отправляется уведомление в `RESUME_CHANNEL`. Если запрос
+        одновременно выполняют несколько процессов, каждое резюме вернётся только одному из них.
+
+        :return: деактивированные резюме, сгруппированные по пользователям
+        """
+        async with Cursor('resume.deactivate_expired') as cur:
+            await cur.execute(
+                """
+                WITH expired AS (
+                    UPDATE
                         public.resume
+                    SET
+                        is_active=false
                     WHERE
-                        user_id=%(user_id)s AND
-                        is_active;
-                    """,
-                    {
-                        'user_id': user.user_id
-                    }
+                        is_active
+                        AND until < now()
+                    RETURNING
+                        resume_id, user_id, title, status, next_publish_at, access, until
                 )
+                SELECT
+                    resume_id,
+                    user_id,
+                    title,
+                    status,
+                    next_publish_at,
+                    access,
+                    until,
+                    pg_notify(%(channel)s, resume_id)
+                FROM
+                    expired
+                ORDER BY
+                    user_id;
+                """,
+                {'channel': RESUME_CHANNEL}
+            )
 
-                resumes = await cur.fetchall()
-                return [
+            expired: Dict[UserID, List[HeadHunterResume]] = {}
+            for r in await cur.fetchall():
+                expired.setdefault(r[1], []).append(
                     HeadHunterResume(
                         resume_id=r[0],
                         user_id=r[1],
@@ -275,85 +704,186 @@ class HeadHunterResume:
                         status=r[3],
                         next_publish_at=r[4],
                         access=r[5],
-                        is_active=r[6],
-                        until=r[7]
+                        is_active=False,
+                        until=r[6]
                     )
-                    for r in resumes
-                ]
+                )
+            if expired:
+                bot.log.info(f'Models: Deactivated {sum(map(len, expired.values()))} expired resumes')
+            return expired
 
     @staticmethod
-    async def get_active_resume_list() -> Dict[UserID, List[Dict[str, Union['HeadHunterResume', 'TelegramUser']]]]:
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                bot.log.info(f'Models: Getting active resume list...')
-                await cur.execute(
-                    """
-                    SELECT
-                        public.resume.resume_id,  -- 0
-                        public.resume.title,      -- 1
-                        public.resume.status,     -- 2
-                        public.resume.next_publish_at,  -- 3
-                        public.resume.access,     -- 4
-                        public.resume.until,      -- 5
-                        public.user.user_id       -- 6
-                        public.user.hh_token      -- 7
-                    FROM
-                        public.resume
-                    JOIN
-                        public.user ON public.user.user_id = public.resume.user_id
-                    WHERE
-                        active;
-                    """
-                )
+    async def renew_leases(owner: str, lease_seconds: float) -> int:
+        """Продлить аренду всех резюме, захваченных воркером.
 
-                resumes_and_users = {}
-
-                for r in await cur.fetchall():
-                    user_id = r[6]
-                    if user_id not in resumes_and_users:
-                        resumes_and_users[user_id] = []
-
-                    resumes_and_users[user_id].append(
-                        {
-                            'resume': HeadHunterResume(
-                                resume_id=r[0],
-                                title=r[1],
-                                status=r[2],
-                                next_publish_at=r[3],
-                                access=r[4],
-                                until=r[5]
-                            ),
-                            'user': TelegramUser(
-                                user_id=user_id,
-                                hh_token=r[7]
-                            )
-                        }
-                    )
+        :return: количество резюме, аренда которых продлена
+        """
+        async with Cursor('resume.renew_leases') as cur:
+            await cur.execute(
+                """
+                UPDATE
+                    public.resume
+                SET
+                    lease_until = now() + %(lease_seconds)s * interval '1 second'
+                WHERE
+                    lease_owner = %(owner)s;
+                """,
+                {'owner': owner, 'lease_seconds': lease_seconds}
+            )
+            return cur.rowcount
+
+    @staticmethod
+    async def release_leases(owner: str, resume_ids: List[ResumeID], retry_delay: float) -> None:
+        """Снять аренду с обработанных резюме.
+
+        Резюме, которое так и не удалось поднять, остаётся без владельца, но с арендой ещё
+        на `retry_delay` секунд, чтобы его не захватили снова сразу же.
+        """
+        if not resume_ids:
+            return
+
+        async with Cursor('resume.release_leases') as cur:
+            await cur.execute(
+                """
+                UPDATE
+                    public.resume
+                SET
+                    lease_owner = NULL,
+                    lease_until = CASE
+                        WHEN is_active AND next_publish_at <= now()
+                        THEN now() + %(retry_delay)s * interval '1 second'
+                    END
+                WHERE
+                    lease_owner = %(owner)s
+                    AND resume_id = ANY(%(resume_ids)s);
+                """,
+                {'owner': owner, 'resume_ids': resume_ids, 'retry_delay': retry_delay}
+            )
+
+
+async def on_user_changed(payload: str) -> None:
+    """Сбросить из кэша пользователя, изменённого другим процессом."""
+    origin, user_id = payload.split(':', 1)
+    if origin != process_id:
+        user_cache.invalidate(int(user_id))
+
+
+async def watch_user_changes() -> None:
+    """Слушать изменения пользователей в других процессах; при потере соединения кэш сбрасывается."""
+    while True:
+        try:
+            await listen(USER_CHANNEL, on_user_changed)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            bot.log.exception('Models: User change listener failed, clearing user cache')
+            user_cache.clear()
+            await asyncio.sleep(5)
+
+
+class ResumeUpdateBuffer:
+    """Буфер отложенной записи резюме в БД.
+
+    Накопленные резюме сохраняются одним запросом `HeadHunterResume.update_many`, когда их набирается
+    `max_size` или раз в `flush_interval` секунд, а также при закрытии буфера."""
+
+    max_size: int
+    flush_interval: float
+
+    def __init__(self, max_size: int = None, flush_interval: float = None):
+        self.max_size = max_size or int(os.environ.get('DB_WRITE_BATCH_SIZE', 500))
+        self.flush_interval = flush_interval or float(os.environ.get('DB_WRITE_FLUSH_INTERVAL', 5))
+        self._pending: Dict[ResumeID, HeadHunterResume] = {}
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def __aenter__(self) -> 'ResumeUpdateBuffer':
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        """Запустить периодическую запись."""
+        if self._flusher is None:
+            self._flusher = asyncio.ensure_future(self._flush_periodically())
+
+    async def add(self, resume: HeadHunterResume) -> None:
+        """Поставить резюме в очередь на запись; более поздняя запись того же резюме заменяет раннюю."""
+        # snapshot, so that later changes of the caller's object don't leak into the batch
+        self._pending[resume.resume_id] = HeadHunterResume(**resume.as_dict())
+        if len(self._pending) >= self.max_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Записать всё накопленное."""
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await HeadHunterResume.update_many(list(batch.values()))
+            except BaseException:
+                # keep the batch for the next flush unless newer data arrived meanwhile
+                batch.update(self._pending)
+                self._pending = batch
+                raise
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                bot.log.exception('Models: Failed to flush resume updates')
 
-                return resumes_and_users
+    async def close(self) -> None:
+        """Остановить периодическую запись и записать остаток."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
 
 
 class TelegramUser:
     """Пользователь бота в Telegram."""
 
+    __slots__ = (
+        'user_id', 'hh_token', 'first_name', 'last_name', 'email', 'is_waiting_for_token', 'user_data_updated_at',
+        'auth_failures', 'token_quarantined_at'
+    )
+
     user_id: UserID
     """Идентификатор пользователя в Telegram."""
 
-    hh_token: str = None
+    hh_token: str
     """Токен для доступа к API hh.ru."""
 
-    first_name: str = None
+    first_name: str
     """Имя пользователя (берется из данных пользователя на hh.ru)."""
 
-    last_name: str = None
+    last_name: str
     """Фамилия пользователя (берется из данных пользователя на hh.ru)."""
 
-    email: str = None
+    email: str
     """Адрес электронной почты (берется из данных пользователя на hh.ru)."""
 
-    is_waiting_for_token: bool = True
+    is_waiting_for_token: bool
     """Состояние: ожидается ли от пользователя токен в следующем сообщении."""
 
+    user_data_updated_at: datetime
+    """Когда имя, фамилия и email последний раз получены с hh.ru."""
+
+    auth_failures: int
+    """Сколько раз подряд hh.ru отклонил токен пользователя."""
+
+    token_quarantined_at: Optional[datetime]
+    """Когда токен помещён в карантин: резюме пользователя не поднимаются, пока он не пришлёт новый токен."""
+
     def __init__(
             self,
             user_id: UserID,
@@ -361,7 +891,10 @@ class TelegramUser:
             first_name: str=None,
             last_name: str=None,
             email: str=None,
-            is_waiting_for_token: bool=True
+            is_waiting_for_token: bool=True,
+            user_data_updated_at: datetime=None,
+            auth_failures: int=0,
+            token_quarantined_at: datetime=None
     ):
         self.user_id = user_id
         self.hh_token = hh_token
@@ -369,6 +902,9 @@ class TelegramUser:
         self.last_name = last_name
         self.email = email
         self.is_waiting_for_token = is_waiting_for_token
+        self.user_data_updated_at = user_data_updated_at
+        self.auth_failures = auth_failures
+        self.token_quarantined_at = token_quarantined_at
 
     def as_dict(self):
         return dict(
@@ -377,109 +913,252 @@ class TelegramUser:
             first_name=self.first_name,
             last_name=self.last_name,
             email=self.email,
-            is_waiting_for_token=self.is_waiting_for_token
+            is_waiting_for_token=self.is_waiting_for_token,
+            user_data_updated_at=self.user_data_updated_at,
+            auth_failures=self.auth_failures,
+            token_quarantined_at=self.token_quarantined_at
         )
 
-    @staticmethod
-    async def create_table() -> None:
-        """Метод для создания таблицы в БД."""
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                bot.log.info("Models: Creating table 'public.user'...")
-                await cur.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS public."user"
-                    (
-                        user_id bigint NOT NULL,
-                        hh_token character varying(64) COLLATE pg_catalog."default",
-                        first_name character varying(64) COLLATE pg_catalog."default",
-                        last_name character varying(64) COLLATE pg_catalog."default",
-                        email character varying(64) COLLATE pg_catalog."default",
-                        is_waiting_for_token boolean NOT NULL DEFAULT true,
-                        CONSTRAINT user_pkey PRIMARY KEY (user_id)
-                    )
-                    WITH (
-                        OIDS = FALSE
-                    )
-                    TABLESPACE pg_default;
+    def _params(self) -> Dict[str, Any]:
+        """Параметры запроса: поля пользователя и уведомление об его изменении."""
+        return dict(self.as_dict(), channel=USER_CHANNEL, payload=f'{process_id}:{self.user_id}')
 
-                    ALTER TABLE public."user"
-                        OWNER to postgres;
-                    """
-                )
+    def is_user_data_stale(self, ttl: timedelta) -> bool:
+        """Устарели ли данные пользователя, полученные с hh.ru."""
+        return (
+            self.user_data_updated_at is None or
+            self.user_data_updated_at + ttl < datetime.now(timezone.utc)
+        )
+
+    # single statements (notification in the same query) so that they can be prepared
+    _create = Statement(
+        'user_create',
+        """
+        WITH created AS (
+            INSERT INTO
+                public.user
+                (user_id, hh_token, first_name, last_name, email, is_waiting_for_token, user_data_updated_at)
+            VALUES
+            (
+                %(user_id)s,
+                %(hh_token)s,
+                %(first_name)s,
+                %(last_name)s,
+                %(email)s,
+                %(is_waiting_for_token)s,
+                %(user_data_updated_at)s
+            )
+            RETURNING user_id
+        )
+        SELECT pg_notify(%(channel)s, %(payload)s) FROM created;
+        """
+    )
 
     async def create(self) -> None:
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                bot.log.info(f'Models: Creating user with id {self.user_id}...')
-                await cur.execute(
-                    """
-                    INSERT INTO
-                        public.user
-                        (user_id, hh_token, first_name, last_name, email, is_waiting_for_token)
-                    VALUES
-                    (
-                        %(user_id)s,
-                        %(hh_token)s,
-                        %(first_name)s,
-                        %(last_name)s,
-                        %(email)s,
-                        %(is_waiting_for_token)s
-                    );
-                    """,
-                    self.as_dict()
-                )
+        async with Cursor('user.create') as cur:
+            bot.log.debug('Models: Creating user with id %s...', self.user_id)
+            await TelegramUser._create.execute(cur, self._params())
+        user_cache.put(self.user_id, copy.copy(self))
+
+    _get = Statement(
+        'user_get',
+        """
+        SELECT
+            user_id,
+            hh_token,
+            first_name,
+            last_name,
+            email,
+            is_waiting_for_token,
+            user_data_updated_at,
+            auth_failures,
+            token_quarantined_at
+        FROM
+            public.user
+        WHERE
+            user_id = %(user_id)s;
+        """
+    )
 
     @staticmethod
     async def get(user_id: UserID) -> Optional['TelegramUser']:
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                bot.log.info(f'Models: Getting user with id {user_id}...')
-                await cur.execute(
-                    """
-                    SELECT
-                        user_id,
-                        hh_token,
-                        first_name,
-                        last_name,
-                        email,
-                        is_waiting_for_token
-                    FROM
-                        public.user
-                    WHERE
-                        user_id = %(user_id)s;
-                    """,
-                    {'user_id': user_id}
-                )
-                user = await cur.fetchone()
-                if not user:
-                    return None
-                return TelegramUser(
-                    user_id=user[0],
-                    hh_token=user[1],
-                    first_name=user[2],
-                    last_name=user[3],
-                    email=user[4],
-                    is_waiting_for_token=user[5]
-                )
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            # callers mutate users before update(), so never hand out the cached object
+            return copy.copy(cached)
+
+        async with Cursor('user.get') as cur:
+            bot.log.debug('Models: Getting user with id %s...', user_id)
+            user = await TelegramUser._get.fetch_one(cur, TelegramUser, {'user_id': user_id})
+            if user is None:
+                return None
+            user_cache.put(user_id, copy.copy(user))
+            return user
+
+    _update = Statement(
+        'user_update',
+        """
+        WITH updated AS (
+            UPDATE
+                public.user
+            SET
+                hh_token=%(hh_token)s,
+                first_name=%(first_name)s,
+                last_name=%(last_name)s,
+                email=%(email)s,
+                is_waiting_for_token=%(is_waiting_for_token)s,
+                user_data_updated_at=%(user_data_updated_at)s
+            WHERE
+                user_id=%(user_id)s
+            RETURNING
+                auth_failures,
+                token_quarantined_at
+        )
+        SELECT auth_failures, token_quarantined_at, pg_notify(%(channel)s, %(payload)s) FROM updated;
+        """
+    )
 
     async def update(self) -> None:
-        async with bot.pg_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                bot.log.info(f"Models: Updating user with id {self.user_id}...")
+        """Сохранить пользователя.
 
-                await cur.execute(
-                    """
-                    UPDATE
-                        public.user
-                    SET
-                        hh_token=%(hh_token)s,
-                        first_name=%(first_name)s,
-                        last_name=%(last_name)s,
-                        email=%(email)s,
-                        is_waiting_for_token=%(is_waiting_for_token)s
-                    WHERE
-                        user_id=%(user_id)s;
-                    """,
-                    self.as_dict()
-                )
+        Счётчик ошибок авторизации и карантин токена не записываются: их меняют только
+        `record_auth_failure`, `reset_auth_failures` и `update_token`, а в объекте они могут быть устаревшими.
+        """
+        async with Cursor('user.update') as cur:
+            bot.log.debug('Models: Updating user with id %s...', self.user_id)
+            await TelegramUser._update.execute(cur, self._params())
+            row = await cur.fetchone()
+        if row is not None:
+            self.auth_failures, self.token_quarantined_at, _ = row
+        user_cache.put(self.user_id, copy.copy(self))
+
+    _update_token = Statement(
+        'user_update_token',
+        """
+        WITH updated AS (
+            UPDATE
+                public.user
+            SET
+                hh_token=%(hh_token)s,
+                first_name=%(first_name)s,
+                last_name=%(last_name)s,
+                email=%(email)s,
+                is_waiting_for_token=%(is_waiting_for_token)s,
+                user_data_updated_at=%(user_data_updated_at)s,
+                auth_failures=0,
+                token_quarantined_at=NULL
+            WHERE
+                user_id=%(user_id)s
+            RETURNING user_id
+        )
+        SELECT pg_notify(%(channel)s, %(payload)s) FROM updated;
+        """
+    )
+
+    async def update_token(self) -> None:
+        """Сохранить пользователя с новым, уже проверенным токеном и снять карантин старого."""
+        async with Cursor('user.update_token') as cur:
+            bot.log.debug('Models: Updating token of user with id %s...', self.user_id)
+            await TelegramUser._update_token.execute(cur, self._params())
+        self.auth_failures = 0
+        self.token_quarantined_at = None
+        user_cache.put(self.user_id, copy.copy(self))
+
+    _update_user_data = Statement(
+        'user_update_user_data',
+        """
+        WITH updated AS (
+            UPDATE
+                public.user
+            SET
+                first_name=%(first_name)s,
+                last_name=%(last_name)s,
+                email=%(email)s,
+                user_data_updated_at=%(user_data_updated_at)s
+            WHERE
+                user_id=%(user_id)s
+            RETURNING user_id
+        )
+        SELECT pg_notify(%(channel)s, %(payload)s) FROM updated;
+        """
+    )
+
+    async def update_user_data(self) -> None:
+        """Сохранить только данные пользователя, полученные с hh.ru."""
+        async with Cursor('user.update_user_data') as cur:
+            bot.log.debug('Models: Updating hh.ru data of user with id %s...', self.user_id)
+            await TelegramUser._update_user_data.execute(cur, self._params())
+        # the object may hold only some of the columns, so drop the cached copy instead of replacing it
+        user_cache.invalidate(self.user_id)
+
+    _record_auth_failure = Statement(
+        'user_record_auth_failure',
+        """
+        WITH updated AS (
+            UPDATE
+                public.user
+            SET
+                auth_failures=auth_failures + 1,
+                token_quarantined_at=CASE
+                    WHEN token_quarantined_at IS NULL AND auth_failures + 1 >= %(threshold)s THEN now()
+                    ELSE token_quarantined_at
+                END
+            WHERE
+                user_id=%(user_id)s
+                AND hh_token=%(hh_token)s
+            RETURNING
+                auth_failures,
+                token_quarantined_at
+        )
+        SELECT
+            auth_failures,
+            token_quarantined_at,
+            -- now() is the transaction start time, so it only matches a quarantine set by this statement
+            token_quarantined_at = now(),
+            pg_notify(%(channel)s, %(payload)s)
+        FROM
+            updated;
+        """
+    )
+
+    async def record_auth_failure(self, threshold: int) -> str:
+        """Учесть, что hh.ru отклонил токен, и поместить токен в карантин после `threshold` ошибок подряд.
+
+        Если пользователь уже сменил токен, ничего не меняется.
+
+        :param threshold: после скольких ошибок подряд помещать токен в карантин
+        :return: `AUTH_FAILURE_COUNTED`, `TOKEN_QUARANTINED` или `TOKEN_CHANGED`
+        """
+        async with Cursor('user.record_auth_failure') as cur:
+            await TelegramUser._record_auth_failure.execute(cur, dict(self._params(), threshold=threshold))
+            row = await cur.fetchone()
+        user_cache.invalidate(self.user_id)
+        if row is None:
+            return TOKEN_CHANGED
+        self.auth_failures, self.token_quarantined_at, quarantined, _ = row
+        return TOKEN_QUARANTINED if quarantined else AUTH_FAILURE_COUNTED
+
+    _reset_auth_failures = Statement(
+        'user_reset_auth_failures',
+        """
+        WITH updated AS (
+            UPDATE
+                public.user
+            SET
+                auth_failures=0
+            WHERE
+                user_id=%(user_id)s
+                AND hh_token=%(hh_token)s
+                AND auth_failures > 0
+            RETURNING user_id
+        )
+        SELECT pg_notify(%(channel)s, %(payload)s) FROM updated;
+        """
+    )
+
+    async def reset_auth_failures(self) -> None:
+        """Сбросить счётчик ошибок авторизации после запроса, который hh.ru принял."""
+        async with Cursor('user.reset_auth_failures') as cur:
+            await TelegramUser._reset_auth_failures.execute(cur, self._params())
+        self.auth_failures = 0
+        user_cache.invalidate(self.user_id)
@@ -0,0 +1,160 @@
+from typing import Any, Awaitable, Callable, List, Optional
+from collections import OrderedDict
+import time
+import asyncio
+import itertools
+import logging
+import telepot.exception
+from bot.rate_limiter import TokenBucket
+
+log = logging.getLogger('hh-update-bot')
+
+PRIORITY_INTERACTIVE = 0
+"""Ответ на сообщение пользователя: отправляется в первую очередь."""
+
+PRIORITY_BULK = 1
+"""Массовые уведомления: отправляются, когда нет интерактивных ответов."""
+
+
+class OutgoingMessage:
+    """Сообщение в очереди на отправку."""
+
+    chat_id: int
+    text: str
+    queued_at: float
+
+    def __init__(self, chat_id: int, text: str):
+        self.chat_id = chat_id
+        self.text = text
+        self.queued_at = time.monotonic()
+
+
+class OutboxStats:
+    """Счётчики доставки исходящих сообщений."""
+
+    queued: int
+    sent: int
+    retried: int
+    failed: int
+    latency_total: float
+    latency_max: float
+
+    def __init__(self):
+        self.queued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def __str__(self) -> str:
+        latency_avg = self.latency_total / self.sent if self.sent else 0.0
+        return (f'queued={self.queued}, sent={self.sent}, retried={self.retried}, failed={self.failed}, '
+                f'latency_avg={latency_avg:.2f}s, latency_max={self.latency_max:.2f}s')
+
+
+class Outbox:
+    """Очередь исходящих сообщений Telegram с учётом ограничений на частоту отправки.
+
+    Сообщения раскладываются по `shards` очередям с приоритетом по идентификатору чата, поэтому
+    сообщения одного чата с одинаковым приоритетом уходят по порядку. Частоту ограничивают
+    общее ведро токенов (`global_rate` сообщений в секунду) и ведро на каждый чат (`chat_rate`).
+    На ответ 429 отправка повторяется через `retry_after` секунд из ответа Telegram."""
+
+    stats: OutboxStats
+
+    def __init__(
+            self,
+            send: Callable[[int, str], Awaitable[Any]],
+            shards: int = 4,
+            global_rate: float = 30,
+            chat_rate: float = 1,
+            chat_burst: float = 3,
+            max_retries: int = 5,
+            max_chats: int = 10000
+    ):
+        self.stats = OutboxStats()
+        self._send = send
+        self._queues: List[asyncio.PriorityQueue] = [asyncio.PriorityQueue() for _ in range(shards)]
+        self._senders: List[asyncio.Future] = []
+        self._counter = itertools.count()
+        self._global = TokenBucket(global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats: 'OrderedDict[int, TokenBucket]' = OrderedDict()
+        self._max_chats = max_chats
+        self._max_retries = max_retries
+
+    def __len__(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def enqueue(self, chat_id: int, text: str, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Поставить сообщение в очередь; не ждёт отправки."""
+        queue = self._queues[chat_id % len(self._queues)]
+        queue.put_nowait((priority, next(self._counter), OutgoingMessage(chat_id, text)))
+        self.stats.queued += 1
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+            if len(self._chats) > self._max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _deliver(self, message: OutgoingMessage) -> None:
+        for _ in range(self._max_retries + 1):
+            delay = max(self._global.reserve(), self._chat_bucket(message.chat_id).reserve())
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                await self._send(message.chat_id, message.text)
+            except telepot.exception.TooManyRequestsError as e:
+                retry_after = (e.json or {}).get('parameters', {}).get('retry_after', 1)
+                log.warning(f'Outbox: Telegram asks to retry after {retry_after}s (chat {message.chat_id})')
+                self.stats.retried += 1
+                await asyncio.sleep(retry_after)
+                continue
+            except Exception:
+                log.exception(f'Outbox: failed to send message to chat {message.chat_id}')
+                self.stats.failed += 1
+                return
+
+            latency = time.monotonic() - message.queued_at
+            self.stats.sent += 1
+            self.stats.latency_total += latency
+            self.stats.latency_max = max(self.stats.latency_max, latency)
+            return
+
+        log.error(f'Outbox: giving up on message to chat {message.chat_id}')
+        self.stats.failed += 1
+
+    async def _sender(self, queue: asyncio.PriorityQueue) -> None:
+        while True:
+            _, _, message = await queue.get()
+            try:
+                await self._deliver(message)
+            finally:
+                queue.task_done()
+
+    def start(self) -> None:
+        """Запустить отправителей."""
+        if not self._senders:
+            self._senders = [asyncio.ensure_future(self._sender(queue)) for queue in self._queues]
+
+    async def join(self) -> None:
+        """Дождаться отправки всех сообщений из очереди."""
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """Отправить оставшиеся сообщения (не дольше `timeout` секунд) и остановить отправителей."""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f'Outbox: stopping with {len(self)} messages left unsent')
+        for sender in self._senders:
+            sender.cancel()
+        self._senders = []
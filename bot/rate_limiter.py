@@ -0,0 +1,174 @@
+from typing import Callable, Dict, Optional
+from collections import OrderedDict
+import time
+import asyncio
+
+
+class TokenBucket:
+    """Ведро токенов: в среднем `rate` запросов в секунду, всплеском до `capacity`.
+
+    Токены резервируются заранее (их количество может уйти в минус), поэтому конкурирующие корутины
+    выстраиваются в очередь по времени резервирования и не будят друг друга.
+
+    :param clock: монотонные часы в секундах, по которым пополняется ведро; по умолчанию time.monotonic
+    """
+
+    rate: float
+    capacity: float
+
+    def __init__(self, rate: float, capacity: float = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated_at = clock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self, now: float = None) -> float:
+        """Зарезервировать один токен.
+
+        :return: сколько секунд нужно подождать, прежде чем им воспользоваться
+        """
+        now = self._clock() if now is None else now
+        self._refill(now)
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.rate)
+
+    def set_rate(self, rate: float) -> None:
+        self._refill(self._clock())
+        self.rate = rate
+
+
+class RateLimiterStats:
+    """Счётчики ограничителя частоты запросов."""
+
+    requests: int
+    """Сколько запросов прошло через ограничитель."""
+
+    delayed: int
+    """Сколько запросов пришлось задержать."""
+
+    delay_total: float
+    """Суммарная задержка в секундах."""
+
+    throttled: int
+    """Сколько раз hh.ru ответил 429 или 5xx."""
+
+    backoffs: int
+    """Сколько раз ограничитель снижал глобальную частоту."""
+
+    def __init__(self):
+        self.requests = 0
+        self.delayed = 0
+        self.delay_total = 0.0
+        self.throttled = 0
+        self.backoffs = 0
+
+    def __str__(self) -> str:
+        return (f'requests={self.requests}, delayed={self.delayed}, delay_total={self.delay_total:.2f}s, '
+                f'throttled={self.throttled}, backoffs={self.backoffs}')
+
+
+class RateLimiter:
+    """Клиентский ограничитель частоты запросов с отдельными бюджетами на весь процесс, на токен и на метод API.
+
+    Глобальная частота подстраивается по AIMD: растёт на `increase` после каждого успешного ответа
+    и падает вдвое (не чаще раза в `backoff_interval` секунд) после 429 или 5xx. Заголовок Retry-After
+    приостанавливает все запросы на указанное время.
+
+    :param clock: часы, общие для всех вёдер ограничителя и паузы по Retry-After
+    """
+
+    min_rate: float
+    max_rate: float
+    increase: float
+    backoff_interval: float
+    stats: RateLimiterStats
+
+    def __init__(
+            self,
+            global_rate: float,
+            token_rate: float,
+            endpoint_rates: Dict[str, float] = None,
+            min_rate: float = 1.0,
+            increase: float = 0.1,
+            backoff_interval: float = 1.0,
+            max_tokens: int = 10000,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        self.min_rate = min_rate
+        self.max_rate = global_rate
+        self.increase = increase
+        self.backoff_interval = backoff_interval
+        self.stats = RateLimiterStats()
+
+        self._clock = clock
+        self._global = TokenBucket(global_rate, clock=clock)
+        self._token_rate = token_rate
+        self._tokens: 'OrderedDict[str, TokenBucket]' = OrderedDict()
+        self._max_tokens = max_tokens
+        self._endpoints = {
+            endpoint: TokenBucket(rate, clock=clock) for endpoint, rate in (endpoint_rates or {}).items()
+        }
+        self._paused_until = 0.0
+        self._backed_off_at = 0.0
+
+    @property
+    def global_rate(self) -> float:
+        """Текущая глобальная частота запросов в секунду."""
+        return self._global.rate
+
+    def _token_bucket(self, token: str) -> TokenBucket:
+        bucket = self._tokens.get(token)
+        if bucket is None:
+            bucket = self._tokens[token] = TokenBucket(self._token_rate, clock=self._clock)
+            if len(self._tokens) > self._max_tokens:
+                # forget the least recently used token
+                self._tokens.popitem(last=False)
+        else:
+            self._tokens.move_to_end(token)
+        return bucket
+
+    async def acquire(self, token: str, endpoint: str) -> float:
+        """Дождаться разрешения на запрос.
+
+        :param token: токен пользователя, от имени которого делается запрос
+        :param endpoint: название метода API
+        :return: сколько секунд пришлось ждать
+        """
+        now = self._clock()
+        delay = max(
+            self._paused_until - now,
+            self._global.reserve(now),
+            self._token_bucket(token).reserve(now),
+            self._endpoints[endpoint].reserve(now) if endpoint in self._endpoints else 0.0,
+        )
+
+        self.stats.requests += 1
+        if delay > 0:
+            self.stats.delayed += 1
+            self.stats.delay_total += delay
+            await asyncio.sleep(delay)
+        return delay
+
+    def on_success(self) -> None:
+        """Аддитивно увеличить глобальную частоту."""
+        if self._global.rate < self.max_rate:
+            self._global.set_rate(min(self.max_rate, self._global.rate + self.increase))
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        """Мультипликативно снизить глобальную частоту после 429 или 5xx.
+
+        :param retry_after: значение заголовка Retry-After в секундах, если он был
+        """
+        now = self._clock()
+        self.stats.throttled += 1
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+        if now - self._backed_off_at >= self.backoff_interval:
+            self._backed_off_at = now
+            self.stats.backoffs += 1
+            self._global.set_rate(max(self.min_rate, self._global.rate / 2))
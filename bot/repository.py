@@ -0,0 +1,103 @@
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Set, Tuple, Type, TypeVar
+import os
+import re
+import weakref
+import psycopg2
+
+Model = TypeVar('Model')
+RowFactory = Callable[[Sequence[Any]], Any]
+
+prepare_statements: bool = os.environ.get('POSTGRES_PREPARE', '1') != '0'
+"""Выполнять частые запросы как подготовленные (PREPARE/EXECUTE), а не отправлять каждый раз текст запроса."""
+
+duplicate_prepared_statement = '42P05'
+"""SQLSTATE ошибки «подготовленный запрос с таким именем уже существует»."""
+
+_placeholder = re.compile(r'%\((\w+)\)s')
+
+_prepared: 'weakref.WeakKeyDictionary[Any, Set[str]]' = weakref.WeakKeyDictionary()
+"""Какие запросы уже подготовлены на каждом соединении."""
+
+_row_factories: Dict[Tuple[type, Tuple[str, ...]], RowFactory] = {}
+
+
+def row_factory(model: Type[Model], columns: Sequence[str]) -> Callable[[Sequence[Any]], Model]:
+    """Сгенерировать функцию, создающую объект модели из строки с указанными столбцами.
+
+    Функция собирается из исходного кода один раз на модель и набор столбцов, как namedtuple,
+    и передаёт каждый столбец в конструктор по имени без промежуточного словаря.
+    """
+    key = (model, tuple(columns))
+    factory = _row_factories.get(key)
+    if factory is None:
+        for column in columns:
+            if not column.isidentifier():
+                raise ValueError(f'Column {column!r} is not a valid argument name')
+        args = ', '.join(f'{column}=row[{n}]' for n, column in enumerate(columns))
+        namespace: Dict[str, Any] = {'model': model}
+        exec(f'def {model.__name__.lower()}_from_row(row):\n    return model({args})', namespace)
+        factory = _row_factories[key] = namespace[f'{model.__name__.lower()}_from_row']
+    return factory
+
+
+class Statement:
+    """Запрос, который на каждом соединении подготавливается один раз и дальше выполняется через EXECUTE.
+
+    Текст запроса пишется с именованными параметрами %(name)s, как обычно для psycopg2; при
+    подготовке они заменяются на позиционные $1, $2, ... Если `prepare_statements` выключен,
+    запрос выполняется как есть.
+    """
+
+    name: str
+    sql: str
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+
+        self._params: List[str] = []
+        for param in _placeholder.findall(sql):
+            if param not in self._params:
+                self._params.append(param)
+        self._prepare_sql = f'PREPARE {name} AS ' + _placeholder.sub(
+            lambda m: f'${self._params.index(m.group(1)) + 1}', sql.strip().rstrip(';')
+        ) + ';'
+        if self._params:
+            self._execute_sql = f'EXECUTE {name} ({", ".join(["%s"] * len(self._params))});'
+        else:
+            self._execute_sql = f'EXECUTE {name};'
+
+    async def execute(self, cur, params: Mapping[str, Any] = None) -> None:
+        """Выполнить запрос на курсоре aiopg."""
+        params = params or {}
+        if not prepare_statements:
+            await cur.execute(self.sql, params)
+            return
+
+        prepared = _prepared.setdefault(cur.connection, set())
+        if self.name not in prepared:
+            try:
+                await cur.execute(self._prepare_sql)
+            except psycopg2.Error as e:
+                # already prepared on this session by someone who didn't tell us
+                if e.pgcode != duplicate_prepared_statement:
+                    raise
+            prepared.add(self.name)
+        await cur.execute(self._execute_sql, [params[param] for param in self._params])
+
+    async def fetch_one(self, cur, model: Type[Model], params: Mapping[str, Any] = None) -> Optional[Model]:
+        """Выполнить запрос и построить объект модели из первой строки; None, если строк нет."""
+        await self.execute(cur, params)
+        row = await cur.fetchone()
+        if row is None:
+            return None
+        return row_factory(model, [column[0] for column in cur.description])(row)
+
+    async def fetch_all(self, cur, model: Type[Model], params: Mapping[str, Any] = None) -> List[Model]:
+        """Выполнить запрос и построить объекты модели из всех строк."""
+        await self.execute(cur, params)
+        rows = await cur.fetchall()
+        if not rows:
+            return []
+        factory = row_factory(model, [column[0] for column in cur.description])
+        return [factory(row) for row in rows]
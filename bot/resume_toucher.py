@@ -1,56 +1,720 @@
+from typing import AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar, Union
+import os
+import time
+import socket
+import heapq
+import itertools
 import logging
 import asyncio
 import datetime
 import bot
-from bot.hh_api import HeadHunterAPI, HeadHunterAuthError, HeadHunterResumeUpdateError
-from bot.models import HeadHunterResume
+from bot.hh_api import (
+    HeadHunterAPI, HeadHunterAuthError, HeadHunterNotFoundError, HeadHunterRateLimitError, HeadHunterResumeUpdateError,
+    HeadHunterUnavailableError
+)
+import bot.hh_api
+from bot.models import HeadHunterResume, ResumeID, ResumeUpdateBuffer, TelegramUser, UserResumes
+import bot.models
+import bot.metrics
+from bot.touch_planner import TouchPlanner
 
-# logging
 log = logging.getLogger('hh-update-bot')
-log.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-ch = logging.StreamHandler()
-ch.setFormatter(formatter)
-log.addHandler(ch)
 
 pg_pool = None
 
+touch_concurrency: int = int(os.environ.get('TOUCH_CONCURRENCY', 10))
+"""Сколько пользователей обрабатывается одновременно."""
+
+touch_retry_delay: int = int(os.environ.get('TOUCH_RETRY_DELAY', 600))
+"""Через сколько секунд повторить попытку, если резюме не удалось поднять."""
+
+touch_scheduler_horizon: int = int(os.environ.get('TOUCH_SCHEDULER_HORIZON', 60 * 60))
+"""На сколько секунд вперёд планировщик держит резюме в памяти."""
+
+touch_mode: str = os.environ.get('TOUCH_MODE', 'scheduler')
+"""`scheduler` — один процесс со своим расписанием, `lease` — несколько узлов, захватывающих резюме из БД."""
+
+touch_node_id: str = (os.environ.get('TOUCH_NODE_ID') or f'{socket.gethostname()}-{os.getpid()}')[:64]
+"""Идентификатор узла, которым помечаются захваченные резюме."""
+
+touch_lease_batch: int = int(os.environ.get('TOUCH_LEASE_BATCH', 100))
+"""Сколько резюме узел захватывает за раз."""
+
+touch_lease_seconds: int = int(os.environ.get('TOUCH_LEASE_SECONDS', 300))
+"""Длительность аренды; резюме упавшего узла захватит другой узел через это время."""
+
+touch_lease_poll_interval: float = float(os.environ.get('TOUCH_LEASE_POLL_INTERVAL', 10))
+"""Через сколько секунд снова искать резюме, если поднимать нечего."""
+
+touch_expiry_sweep_interval: float = float(os.environ.get('TOUCH_EXPIRY_SWEEP_INTERVAL', 60))
+"""Как часто деактивировать резюме с истёкшим сроком продвижения, в секундах."""
+
+token_quarantine_failures: int = int(os.environ.get('TOKEN_QUARANTINE_FAILURES', 3))
+"""После скольких ошибок авторизации подряд токен помещается в карантин и резюме пользователя перестают подниматься."""
+
+
+resume_timed_out_message = ('Прошла неделя, и продвижение резюме было автоматически прекращено. '
+                            'Чтобы продолжить, выбери резюме снова.\n\n')
+
+token_quarantined_message = ('hh.ru больше не принимает твой токен, поэтому продвижение резюме приостановлено. '
+                             'Отправь /token и затем новый токен, и резюме снова начнут подниматься.')
+
+Job = TypeVar('Job')
+
+
+class TouchReport:
+    """Итоги одного прохода по активным резюме."""
+
+    due: int
+    """Сколько резюме было пора поднимать."""
+
+    touched: int
+    """Сколько резюме поднято в поиске."""
+
+    too_often: int
+    """Сколько резюме ещё нельзя поднимать."""
+
+    failed: int
+    """Сколько резюме не удалось обновить."""
+
+    auth_errors: int
+    """Сколько резюме пропущено из-за неправильного токена."""
+
+    expired: int
+    """Сколько резюме пропущено, потому что срок их продвижения истёк."""
+
+    deferred: int
+    """Сколько резюме отложено, потому что hh.ru не отвечает."""
+
+    quarantined: int
+    """Сколько резюме пропущено, потому что токен владельца в карантине."""
+
+    started_at: float
+    finished_at: Optional[float]
+
+    def __init__(self, due: int = 0):
+        self.due = due
+        self.touched = 0
+        self.too_often = 0
+        self.failed = 0
+        self.auth_errors = 0
+        self.expired = 0
+        self.deferred = 0
+        self.quarantined = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+
+    @property
+    def wall_time(self) -> float:
+        """Длительность прохода в секундах."""
+        finished_at = self.finished_at if self.finished_at is not None else time.monotonic()
+        return finished_at - self.started_at
+
+    def __str__(self) -> str:
+        return (f'due={self.due}, touched={self.touched}, too_often={self.too_often}, failed={self.failed}, '
+                f'auth_errors={self.auth_errors}, expired={self.expired}, deferred={self.deferred}, '
+                f'quarantined={self.quarantined}, wall_time={self.wall_time:.2f}s')
 
-resume_timed_out_message = 'Продвижение твоего резюме было автоматически прекращено.'
 
+def log_report(report: TouchReport) -> None:
+    bot.metrics.touch_pass_duration.observe(report.wall_time)
+    for outcome in ('due', 'touched', 'too_often', 'failed', 'auth_errors', 'expired', 'deferred', 'quarantined'):
+        bot.metrics.touch_resumes.inc(getattr(report, outcome), outcome=outcome)
 
-async def touch_ready_resumes() -> None:
-    resumes_and_users = await HeadHunterResume.get_active_resume_list()
+    log.info(f'Touch pass finished: {report}')
+    log.info(f'HH connections: {bot.hh_api.connection_stats}')
+    log.info(f'HH rate limiter: {bot.hh_api.rate_limiter.stats}, rate={bot.hh_api.rate_limiter.global_rate:.1f}/s')
 
-    for user_id, user_resumes in resumes_and_users.items():
-        for r in user_resumes:
-            user = r['user']
-            resume = r['resume']
 
+async def run_pool(
+        jobs: Union[Iterable[Job], AsyncIterable[Job]],
+        handler: Callable[[Job], Awaitable[None]],
+        concurrency: int
+) -> None:
+    """Обработать задания пулом из `concurrency` воркеров.
+
+    Каждое задание целиком обрабатывается одним воркером, поэтому порядок внутри задания сохраняется.
+    Задания из асинхронного источника читаются не быстрее, чем воркеры их разбирают.
+
+    :param jobs: задания
+    :param handler: корутина, обрабатывающая одно задание
+    :param concurrency: количество воркеров
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker() -> None:
+        while True:
+            job = await queue.get()
             try:
-                async with await HeadHunterAPI.create(user.hh_token) as api:
-                    if resume.until < datetime.datetime.now():
-                        # notify user and deactivate resume
-                        await bot.send_message(user.user_id, resume_timed_out_message)
-                        await resume.deactivate()
-                    try:
-                        has_updated, resume = await api.touch_resume(resume)
-                        if has_updated:
-                            log.info(f'Resume updated: {resume.title} ({resume.resume_id})')
-                            resume.update()
-                        else:
-                            log.info(f'Too often: {resume.title} ({resume.resume_id})')
-                    except HeadHunterResumeUpdateError:
-                        log.info(f'Error updating resume: {resume.title} ({resume.resume_id})')
-            except HeadHunterAuthError:
-                log.info(f'Wrong token: {user.hh_token}')
+                await handler(job)
+            except Exception:
+                log.exception('Unexpected error in touch worker')
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        if isinstance(jobs, AsyncIterable):
+            async for job in jobs:
+                await queue.put(job)
+        else:
+            for job in jobs:
+                await queue.put(job)
+        await queue.join()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def touch_resume(api: HeadHunterAPI, resume: HeadHunterResume, report: TouchReport,
+                       buffer: ResumeUpdateBuffer) -> HeadHunterResume:
+    """Поднять одно резюме в поиске и поставить результат в очередь на запись.
+
+    :return: резюме с актуальным временем следующей публикации
+    """
+    try:
+        has_updated, fresh = await api.touch_resume(resume)
+    except HeadHunterResumeUpdateError:
+        log.info('Error updating resume: %s (%s)', resume.title, resume.resume_id)
+        report.failed += 1
+        return resume
+    except HeadHunterNotFoundError:
+        # not the token's fault; the user can deactivate a deleted resume
+        log.info('Resume not found on hh.ru: %s (%s)', resume.title, resume.resume_id)
+        report.failed += 1
+        return resume
+    except HeadHunterRateLimitError:
+        log.info('Rate limited by hh.ru: %s (%s)', resume.title, resume.resume_id)
+        report.failed += 1
+        return resume
+
+    if has_updated:
+        log.info('Resume updated: %s (%s)', fresh.title, fresh.resume_id)
+        report.touched += 1
+        await buffer.add(fresh)
+    else:
+        log.info('Too often: %s (%s)', fresh.title, fresh.resume_id)
+        report.too_often += 1
+        # keep the refreshed deadline, so the resume isn't loaded as due again
+        await buffer.add(fresh)
+
+    return fresh
+
+
+async def touch_user_resumes(
+        user: TelegramUser,
+        resumes: List[HeadHunterResume],
+        report: TouchReport,
+        buffer: ResumeUpdateBuffer,
+        on_token_changed: Callable[[bot.models.UserID], Awaitable[None]] = None
+) -> List[HeadHunterResume]:
+    """Поднять по очереди все резюме одного пользователя.
+
+    Резюме с истёкшим сроком продвижения пропускаются: их деактивирует `sweep_expired_resumes`.
+    Если токен пользователя в карантине, запросы к hh.ru не делаются вовсе.
+
+    :param on_token_changed: вызывается, если hh.ru отклонил токен, который пользователь уже сменил
+    :return: резюме с актуальным временем следующей публикации
+    """
+    if user.token_quarantined_at is not None:
+        # loaded before the quarantine; the queries skip such users
+        report.quarantined += len(resumes)
+        return resumes
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    expired = [resume for resume in resumes if resume.until < now]
+    resumes = [resume for resume in resumes if resume.until >= now]
+    report.expired += len(expired)
+
+    result = []
+    try:
+        if resumes:
+            async with await HeadHunterAPI.for_user(user) as api:
+                for resume in resumes:
+                    result.append(await touch_resume(api, resume, report, buffer))
+            if user.auth_failures:
+                await user.reset_auth_failures()
+    except HeadHunterAuthError:
+        log.info('Wrong token: user %s', user.user_id)
+        report.auth_errors += len(resumes) - len(result)
+        result.extend(resumes[len(result):])
+        if await record_auth_failure(user) == bot.models.TOKEN_CHANGED and on_token_changed is not None:
+            await on_token_changed(user.user_id)
+    except HeadHunterRateLimitError:
+        log.info('Rate limited by hh.ru: user %s', user.user_id)
+        report.failed += len(resumes) - len(result)
+        result.extend(resumes[len(result):])
+    except HeadHunterUnavailableError:
+        log.info('hh.ru is unavailable, deferring resumes of user %s', user.user_id)
+        report.deferred += len(resumes) - len(result)
+        result.extend(resumes[len(result):])
+    return result + expired
+
+
+async def record_auth_failure(user: TelegramUser) -> Optional[str]:
+    """Учесть ошибку авторизации и один раз сообщить пользователю, если токен попал в карантин.
+
+    :return: результат `TelegramUser.record_auth_failure` или None, если его не удалось записать
+    """
+    try:
+        result = await user.record_auth_failure(token_quarantine_failures)
+    except Exception:
+        log.exception('Failed to record an auth failure of user %s', user.user_id)
+        return None
+
+    if result == bot.models.TOKEN_QUARANTINED:
+        log.info('Token of user %s quarantined after %s auth failures', user.user_id, user.auth_failures)
+        await bot.send_message(user.user_id, token_quarantined_message, bot.PRIORITY_BULK)
+    elif result == bot.models.TOKEN_CHANGED:
+        log.info('Token of user %s was replaced, the failure is not counted', user.user_id)
+    return result
+
+
+async def sweep_expired_resumes() -> int:
+    """Деактивировать все резюме с истёкшим сроком продвижения и сообщить об этом владельцам,
+    каждому одним сообщением.
+
+    :return: количество деактивированных резюме
+    """
+    expired = await HeadHunterResume.deactivate_expired()
+    for user_id, resumes in expired.items():
+        msg = resume_timed_out_message
+        msg += '\n\n'.join(f'<b>{r.title}</b>\n/resume_{r.resume_id}' for r in resumes)
+        await bot.send_message(user_id, msg, bot.PRIORITY_BULK)
+    return sum(len(resumes) for resumes in expired.values())
+
+
+async def run_expiry_sweeper(interval: float = None) -> None:
+    """Бесконечно деактивировать резюме с истёкшим сроком раз в `interval` секунд."""
+    while True:
+        try:
+            await sweep_expired_resumes()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception('Expiry sweep failed')
+        await asyncio.sleep(interval or touch_expiry_sweep_interval)
+
+
+async def touch_ready_resumes(concurrency: int = None) -> TouchReport:
+    """Один проход по всем активным резюме.
+
+    Если выключатель hh.ru разомкнут, проход заканчивается, не дочитывая резюме: они будут подняты
+    в следующий раз.
+
+    :param concurrency: сколько пользователей обрабатывать одновременно
+    :return: итоги прохода
+    """
+    await sweep_expired_resumes()
+    report = TouchReport()
+
+    async def jobs() -> AsyncIterable[UserResumes]:
+        # users are touched while the next batches are still being read
+        batches = HeadHunterResume.iter_active_resumes()
+        try:
+            async for batch in batches:
+                for job in batch:
+                    if bot.hh_api.breaker.is_open:
+                        log.warning('hh.ru is unavailable, stopping the touch pass')
+                        return
+                    report.due += len(job[1])
+                    yield job
+        finally:
+            # release the cursor and its connection now rather than when the generator is collected
+            await batches.aclose()
+
+    async with ResumeUpdateBuffer() as buffer:
+        async def handle(job: UserResumes) -> None:
+            user, resumes = job
+            await touch_user_resumes(user, resumes, report, buffer)
+
+        await run_pool(jobs(), handle, concurrency or touch_concurrency)
+
+    report.finish()
+    log_report(report)
+    return report
+
+
+class TouchScheduler:
+    """Планировщик, поднимающий каждое активное резюме, как только наступает его `next_publish_at`.
+
+    В куче по времени следующей публикации хранятся только резюме, которые нужно поднять в ближайшие
+    `horizon` секунд; раз в `horizon / 2` секунд планировщик дочитывает следующее окно по индексу.
+    Об активации и деактивации резюме планировщик узнаёт из канала уведомлений `bot.models.RESUME_CHANNEL`,
+    не перечитывая таблицу, а об изменении пользователей (например, о новом токене) — из
+    `bot.models.USER_CHANNEL`. Время подъёма назначает `TouchPlanner`, разнося резюме с близким
+    `next_publish_at`, чтобы запросы шли ровно."""
+
+    concurrency: int
+    horizon: int
+
+    def __init__(self, concurrency: int = None, horizon: int = None):
+        self.concurrency = concurrency or touch_concurrency
+        self.horizon = horizon or touch_scheduler_horizon
+        self._loaded_until = 0.0
+        self._heap: List[Tuple[float, int, ResumeID]] = []
+        self._versions: Dict[ResumeID, int] = {}
+        self._resumes: Dict[ResumeID, Tuple[TelegramUser, HeadHunterResume]] = {}
+        self._user_resumes: Dict[bot.models.UserID, Set[ResumeID]] = {}
+        self._touching: Set[ResumeID] = set()
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._buffer = ResumeUpdateBuffer()
+        self.planner = TouchPlanner()
+
+    def __len__(self) -> int:
+        return len(self._resumes)
+
+    def schedule(self, user: TelegramUser, resume: HeadHunterResume, at: float = None) -> None:
+        """Запланировать резюме на слот планировщика не раньше `at` (по умолчанию `resume.next_publish_at`)
+        и не раньше текущего момента."""
+        if at is None:
+            at = resume.next_publish_at.timestamp()
+        self._track(user, resume)
+        self._push(resume.resume_id, self.planner.plan(resume.resume_id, max(at, time.time())))
+
+    def _track(self, user: TelegramUser, resume: HeadHunterResume) -> None:
+        self._resumes[resume.resume_id] = (user, resume)
+        self._user_resumes.setdefault(user.user_id, set()).add(resume.resume_id)
+
+    def _untrack(self, resume_id: ResumeID) -> None:
+        tracked = self._resumes.pop(resume_id, None)
+        if tracked is None:
+            return
+        resume_ids = self._user_resumes[tracked[0].user_id]
+        resume_ids.discard(resume_id)
+        if not resume_ids:
+            del self._user_resumes[tracked[0].user_id]
+
+    def _push(self, resume_id: ResumeID, at: float) -> None:
+        version = next(self._counter)
+        self._versions[resume_id] = version
+        heapq.heappush(self._heap, (at, version, resume_id))
+        if self._heap[0][1] == version:
+            # new earliest deadline
+            self._wakeup.set()
+
+    def unschedule(self, resume_id: ResumeID) -> None:
+        """Убрать резюме из расписания; запись в куче станет недействительной.
+
+        Освободившийся слот может занять резюме из более загруженного времени."""
+        self._versions.pop(resume_id, None)
+        self._untrack(resume_id)
+        moved = self.planner.remove(resume_id, time.time())
+        if moved is not None and moved[0] in self._versions:
+            self._push(*moved)
+
+    def _is_valid(self, entry: Tuple[float, int, ResumeID]) -> bool:
+        return self._versions.get(entry[2]) == entry[1]
+
+    def next_deadline(self) -> Optional[float]:
+        """Ближайшее время публикации или None, если расписание пусто."""
+        while self._heap and not self._is_valid(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[UserResumes]:
+        """Забрать из кучи все резюме, время которых наступило, сгруппировав их по пользователям."""
+        by_user: Dict[bot.models.UserID, UserResumes] = {}
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not self._is_valid(entry):
                 continue
+            # a popped resume has no heap entry until it is rescheduled
+            del self._versions[entry[2]]
+            self.planner.release(entry[2])
+            self._touching.add(entry[2])
+            user, resume = self._resumes[entry[2]]
+            by_user.setdefault(user.user_id, (user, []))[1].append(resume)
+        return list(by_user.values())
+
+    def _reschedule(self, resume: HeadHunterResume) -> None:
+        self._touching.discard(resume.resume_id)
+        if resume.resume_id not in self._resumes:
+            # deactivated while being touched
+            return
+        # the user may have been refreshed while the resume was being touched
+        user = self._resumes[resume.resume_id][0]
+        if not resume.is_active or user.token_quarantined_at is not None:
+            # a quarantined user's resumes are loaded again once the new token is saved
+            self.unschedule(resume.resume_id)
+            return
+        at = resume.next_publish_at.timestamp()
+        if at <= time.time():
+            at = time.time() + touch_retry_delay
+        if at > self._loaded_until:
+            # will come back with one of the next windows
+            self.unschedule(resume.resume_id)
+            return
+        self.schedule(user, resume, at)
+
+    async def load(self, reset: bool = False) -> None:
+        """Дочитать в расписание активные резюме, которые нужно поднять в ближайшие `horizon` секунд.
+
+        :param reset: забыть всё, что уже было в расписании, кроме резюме, которые поднимаются прямо сейчас
+        """
+        if reset:
+            self._heap.clear()
+            self._versions.clear()
+            # resumes being touched are rescheduled by touch_due; loaded again, they would be touched twice
+            for resume_id in [resume_id for resume_id in self._resumes if resume_id not in self._touching]:
+                self._untrack(resume_id)
+            self.planner = TouchPlanner()
+
+        loaded_until = time.time() + self.horizon
+        candidates: List[Tuple[TelegramUser, HeadHunterResume]] = []
+        async for batch in HeadHunterResume.iter_active_resumes(
+                due_before=datetime.datetime.fromtimestamp(loaded_until, datetime.timezone.utc)
+        ):
+            for user, resumes in batch:
+                candidates.extend((user, resume) for resume in resumes)
 
+        # planned together, so that the planner sees the whole window; overdue resumes are spread
+        # from now on instead of going out at once
+        now = time.time()
+        earliest: List[Tuple[ResumeID, float]] = []
+        for user, resume in candidates:
+            # already scheduled or being touched right now
+            if resume.resume_id not in self._resumes:
+                self._track(user, resume)
+                earliest.append((resume.resume_id, max(resume.next_publish_at.timestamp(), now)))
+        for resume_id, at in self.planner.plan_many(earliest).items():
+            self._push(resume_id, at)
 
-async def main():
-    loop = asyncio.get_event_loop()
+        self._loaded_until = loaded_until
+        log.info(f'Scheduler: loaded {len(earliest)} resumes, {len(self)} scheduled')
+        self.report_plan()
+
+    def report_plan(self) -> None:
+        """Записать в лог и метрики, насколько ровно распределены подъёмы в загруженном окне."""
+        report = self.planner.report(time.time(), self._loaded_until)
+        bot.metrics.touch_plan_rate.set(report.mean_rate, stat='mean')
+        bot.metrics.touch_plan_rate.set(report.peak_rate, stat='peak')
+        bot.metrics.touch_plan_peak_to_mean.set(report.peak_to_mean)
+        bot.metrics.touch_plan_cv.set(report.cv)
+        log.info(f'Scheduler: plan {report}')
+
+    async def on_resume_changed(self, resume_id: ResumeID) -> None:
+        """Обработать уведомление об активации или деактивации резюме."""
+        resume = await HeadHunterResume.get(resume_id)
+        if not resume or not resume.is_active:
+            log.info(f'Scheduler: resume {resume_id} deactivated')
+            self.unschedule(resume_id)
+            return
+        log.info(f'Scheduler: resume {resume_id} activated')
+        if resume_id in self._touching:
+            # rescheduled by touch_due when the touch is done
+            return
+        if resume.next_publish_at.timestamp() > self._loaded_until:
+            self.unschedule(resume_id)
+            return
+        user = await TelegramUser.get(resume.user_id)
+        self.schedule(user, resume)
+
+    async def refresh_user(self, user_id: bot.models.UserID) -> None:
+        """Перечитать пользователя из БД и подставить его во все его запланированные резюме.
+
+        Если у пользователя ничего не запланировано, БД не запрашивается."""
+        if user_id not in self._user_resumes:
+            return
+        bot.models.user_cache.invalidate(user_id)
+        user = await TelegramUser.get(user_id)
+        # the set may have changed while the user was being read
+        resume_ids = list(self._user_resumes.get(user_id, ()))
+        for resume_id in resume_ids:
+            if user is None:
+                self.unschedule(resume_id)
+            else:
+                self._resumes[resume_id] = (user, self._resumes[resume_id][1])
+        log.info(f'Scheduler: user {user_id} changed, refreshed {len(resume_ids)} resumes')
+
+    async def on_user_changed(self, payload: str) -> None:
+        """Обработать уведомление об изменении пользователя другим процессом."""
+        origin, user_id = payload.split(':', 1)
+        if origin != bot.models.process_id:
+            await self.refresh_user(int(user_id))
+
+    async def _listen(self, channel: str, handler: Callable[[str], Awaitable[None]]) -> None:
+        while True:
+            try:
+                await bot.models.listen(channel, handler)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception(f"Scheduler: listener of '{channel}' failed, reloading resumes")
+                await asyncio.sleep(touch_retry_delay)
+                await self.load(reset=True)
 
+    async def touch_due(self) -> Optional[TouchReport]:
+        """Поднять все резюме, время которых наступило."""
+        due = self.pop_due(time.time())
+        if not due:
+            return None
+
+        report = TouchReport(due=sum(len(resumes) for _, resumes in due))
+
+        async def handle(job: UserResumes) -> None:
+            user, resumes = job
+            try:
+                # a stale token is replaced before the resumes are rescheduled
+                resumes = await touch_user_resumes(user, resumes, report, self._buffer, self.refresh_user)
+            finally:
+                for resume in resumes:
+                    self._reschedule(resume)
+
+        await run_pool(due, handle, self.concurrency)
+
+        report.finish()
+        log_report(report)
+        return report
+
+    async def run(self) -> None:
+        """Работать бесконечно, засыпая до ближайшего времени публикации."""
+        await self.load()
+        listeners = [
+            asyncio.ensure_future(self._listen(bot.models.RESUME_CHANNEL, self.on_resume_changed)),
+            asyncio.ensure_future(self._listen(bot.models.USER_CHANNEL, self.on_user_changed)),
+        ]
+        sweeper = asyncio.ensure_future(run_expiry_sweeper())
+        self._buffer.start()
+        try:
+            while True:
+                refill_at = self._loaded_until - self.horizon / 2
+                if time.time() >= refill_at:
+                    await self.load()
+                    continue
+
+                if bot.hh_api.breaker.is_open:
+                    # due resumes stay in the heap until hh.ru can be tried again
+                    await asyncio.sleep(bot.hh_api.breaker.retry_after)
+                    continue
+
+                if await self.touch_due():
+                    continue
+
+                self._wakeup.clear()
+                deadline = self.next_deadline()
+                wake_at = min(deadline, refill_at) if deadline is not None else refill_at
+                timeout = max(wake_at - time.time(), 0)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for listener in listeners:
+                listener.cancel()
+            sweeper.cancel()
+            await self._buffer.close()
+
+
+class LeaseWorker:
+    """Узел, который захватывает в БД пачки резюме, время которых наступило, и поднимает их.
+
+    Узлов может быть сколько угодно: пачки захватываются через `SELECT ... FOR UPDATE SKIP LOCKED`
+    и аренду в `public.resume`, поэтому каждое резюме поднимает только один узел. Пока пачка
+    обрабатывается, аренда продлевается; после записи результатов она снимается."""
+
+    owner: str
+    batch_size: int
+    lease_seconds: float
+    concurrency: int
+    poll_interval: float
+
+    def __init__(self, owner: str = None, batch_size: int = None, lease_seconds: float = None,
+                 concurrency: int = None, poll_interval: float = None):
+        self.owner = owner or touch_node_id
+        self.batch_size = batch_size or touch_lease_batch
+        self.lease_seconds = lease_seconds or touch_lease_seconds
+        self.concurrency = concurrency or touch_concurrency
+        self.poll_interval = poll_interval or touch_lease_poll_interval
+
+    async def _renew(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await HeadHunterResume.renew_leases(self.owner, self.lease_seconds)
+                log.debug('Lease %s: renewed %s leases', self.owner, renewed)
+            except Exception:
+                log.exception(f'Lease {self.owner}: failed to renew leases')
+
+    async def run_once(self) -> Optional[TouchReport]:
+        """Захватить и поднять одну пачку резюме.
+
+        :return: итоги или None, если поднимать нечего
+        """
+        resumes_and_users = await HeadHunterResume.claim_due(self.owner, self.batch_size, self.lease_seconds)
+        if not resumes_and_users:
+            return None
+
+        jobs: List[UserResumes] = [
+            (user_resumes[0]['user'], [r['resume'] for r in user_resumes])
+            for user_resumes in resumes_and_users.values()
+        ]
+        claimed = [resume.resume_id for _, resumes in jobs for resume in resumes]
+        report = TouchReport(due=len(claimed))
+
+        renewer = asyncio.ensure_future(self._renew())
+        try:
+            # results are written before the leases are released
+            async with ResumeUpdateBuffer(max_size=len(claimed)) as buffer:
+                async def handle(job: UserResumes) -> None:
+                    user, resumes = job
+                    await touch_user_resumes(user, resumes, report, buffer)
+
+                await run_pool(jobs, handle, self.concurrency)
+        finally:
+            renewer.cancel()
+            await HeadHunterResume.release_leases(self.owner, claimed, touch_retry_delay)
+
+        report.finish()
+        log_report(report)
+        return report
+
+    async def run(self, once: bool = False) -> None:
+        """Работать бесконечно, пока есть резюме, и ждать `poll_interval` секунд, когда их нет.
+
+        :param once: остановиться, когда поднимать станет нечего
+        """
+        log.info(f'Lease {self.owner}: started')
+        if once:
+            await sweep_expired_resumes()
+            while not bot.hh_api.breaker.is_open and await self.run_once() is not None:
+                pass
+            return
+
+        # every node sweeps; a resume is deactivated and reported by only one of them
+        sweeper = asyncio.ensure_future(run_expiry_sweeper())
+        try:
+            while True:
+                if bot.hh_api.breaker.is_open:
+                    # don't claim resumes that can't be touched; other nodes may still reach hh.ru
+                    await asyncio.sleep(bot.hh_api.breaker.retry_after)
+                elif await self.run_once() is None:
+                    await asyncio.sleep(self.poll_interval)
+        finally:
+            sweeper.cancel()
+
+
+async def main(once: bool = False):
     log.info('Updating resumes in HH...')
-    loop.create_task(bot.postgres_connect())
-    loop.create_task(touch_ready_resumes())
+    bot.telegram_connect()
+    await bot.start_metrics()
+    await bot.postgres_connect()
+    asyncio.ensure_future(bot.models.watch_user_changes())
+
+    try:
+        if touch_mode == 'lease':
+            await LeaseWorker().run(once=once)
+        elif once:
+            await touch_ready_resumes()
+        else:
+            await TouchScheduler().run()
+    finally:
+        await bot.hh_api.close_session()
+        if bot.outbox_queue is not None:
+            await bot.outbox_queue.stop(timeout=60)
+            log.info(f'Outbox: {bot.outbox_queue.stats}')
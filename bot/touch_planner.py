@@ -0,0 +1,169 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import os
+import math
+import random
+from bot.models import ResumeID
+
+touch_plan_bucket: float = float(os.environ.get('TOUCH_PLAN_BUCKET', 10))
+"""Ширина корзины планировщика в секундах: нагрузка выравнивается между корзинами."""
+
+touch_plan_max_delay: float = float(os.environ.get('TOUCH_PLAN_MAX_DELAY', 600))
+"""На сколько секунд после `next_publish_at` можно отложить подъём резюме ради ровной нагрузки; 0 — не откладывать."""
+
+
+class PlanReport:
+    """Насколько ровно распределены запланированные подъёмы."""
+
+    planned: int
+    """Сколько подъёмов запланировано в окне."""
+
+    mean_rate: float
+    """Средняя частота подъёмов в окне, в секунду."""
+
+    peak_rate: float
+    """Частота подъёмов в самой загруженной корзине, в секунду."""
+
+    peak_to_mean: float
+    """Отношение пиковой частоты к средней; 1 — идеально ровно."""
+
+    cv: float
+    """Коэффициент вариации числа подъёмов по корзинам; 0 — идеально ровно."""
+
+    def __init__(self, counts: List[int], bucket: float):
+        self.planned = sum(counts)
+        mean = self.planned / len(counts) if counts else 0.0
+        peak = max(counts) if counts else 0
+        self.mean_rate = mean / bucket
+        self.peak_rate = peak / bucket
+        self.peak_to_mean = peak / mean if mean else 0.0
+        variance = sum((count - mean) ** 2 for count in counts) / len(counts) if counts else 0.0
+        self.cv = math.sqrt(variance) / mean if mean else 0.0
+
+    def __str__(self) -> str:
+        return (f'planned={self.planned}, mean_rate={self.mean_rate:.2f}/s, peak_rate={self.peak_rate:.2f}/s, '
+                f'peak_to_mean={self.peak_to_mean:.2f}, cv={self.cv:.2f}')
+
+
+class TouchPlanner:
+    """Распределяет подъёмы резюме по времени, чтобы запросы к hh.ru и БД шли ровно, а не всплесками.
+
+    Каждому резюме назначается слот не раньше его `next_publish_at` и не позже чем через `max_delay`
+    секунд после него: время делится на корзины по `bucket` секунд, из корзин этого окна выбирается
+    наименее загруженная (из равно загруженных — самая ранняя), а внутри неё — случайный момент.
+    Так как после подъёма hh.ru отсчитывает одинаковую паузу, однажды разнесённые резюме остаются
+    разнесёнными и дальше: в следующем цикле их корзины свободны, и откладывать их не нужно.
+
+    Когда резюме убирают из плана, в освободившуюся корзину переносится резюме из самой
+    загруженной корзины позже неё, если его уже можно поднять в это время."""
+
+    bucket: float
+    max_delay: float
+
+    def __init__(self, bucket: float = None, max_delay: float = None):
+        self.bucket = bucket or touch_plan_bucket
+        self.max_delay = touch_plan_max_delay if max_delay is None else max_delay
+        self._buckets: Dict[int, Set[ResumeID]] = {}
+        self._slots: Dict[ResumeID, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _index(self, at: float) -> int:
+        return int(at // self.bucket)
+
+    def _load(self, index: int) -> int:
+        return len(self._buckets.get(index, ()))
+
+    def _add(self, resume_id: ResumeID, earliest: float, at: float) -> None:
+        self._buckets.setdefault(self._index(at), set()).add(resume_id)
+        self._slots[resume_id] = (earliest, at)
+
+    def slot(self, resume_id: ResumeID) -> Optional[float]:
+        """Запланированное время подъёма резюме или None."""
+        planned = self._slots.get(resume_id)
+        return planned[1] if planned else None
+
+    def plan(self, resume_id: ResumeID, earliest: float) -> float:
+        """Назначить резюме слот не раньше `earliest`; прежний слот освобождается.
+
+        :param earliest: когда резюме можно поднять (unix time)
+        :return: назначенное время подъёма
+        """
+        self.release(resume_id)
+
+        at = earliest
+        if self.max_delay > 0:
+            latest = earliest + self.max_delay
+            # the least loaded bucket of the window, the earliest one of equally loaded buckets
+            index = min(range(self._index(earliest), self._index(latest) + 1), key=lambda i: (self._load(i), i))
+            # the first and the last buckets are only partly inside the window
+            start = max(index * self.bucket, earliest)
+            end = min((index + 1) * self.bucket, latest)
+            at = start + random.random() * (end - start)
+
+        self._add(resume_id, earliest, at)
+        return at
+
+    def plan_many(self, resumes: Iterable[Tuple[ResumeID, float]]) -> Dict[ResumeID, float]:
+        """Назначить слоты сразу нескольким резюме.
+
+        Резюме планируются от самого позднего `earliest` к самому раннему: так каждое резюме видит
+        уже занятые корзины после себя и откладывается, только если они действительно свободнее.
+        При планировании от ранних к поздним все корзины впереди ещё пусты, и резюме без нужды
+        уезжают к концу окна.
+
+        :param resumes: пары из резюме и времени, когда его можно поднять (unix time)
+        :return: назначенное время подъёма каждого резюме
+        """
+        return {
+            resume_id: self.plan(resume_id, earliest)
+            for resume_id, earliest in sorted(resumes, key=lambda item: item[1], reverse=True)
+        }
+
+    def release(self, resume_id: ResumeID) -> Optional[int]:
+        """Освободить слот резюме, не перераспределяя остальные.
+
+        :return: корзина, в которой был слот, или None, если резюме не было в плане
+        """
+        planned = self._slots.pop(resume_id, None)
+        if planned is None:
+            return None
+        index = self._index(planned[1])
+        members = self._buckets[index]
+        members.discard(resume_id)
+        if not members:
+            del self._buckets[index]
+        return index
+
+    def remove(self, resume_id: ResumeID, now: float) -> Optional[Tuple[ResumeID, float]]:
+        """Убрать резюме из плана и занять освободившееся место резюме из более загруженной корзины.
+
+        :param now: текущее время; прошедшие корзины не заполняются
+        :return: перенесённое резюме и его новое время подъёма или None, если ничего не перенесено
+        """
+        index = self.release(resume_id)
+        if index is None or self.max_delay <= 0 or (index + 1) * self.bucket <= now:
+            return None
+
+        later = range(index + 1, self._index((index + 1) * self.bucket + self.max_delay) + 1)
+        busiest = max(later, key=lambda i: (self._load(i), -i), default=None)
+        if busiest is None or self._load(busiest) <= self._load(index) + 1:
+            return None
+
+        # only a resume that is already publishable within the freed bucket can move into it
+        start = max(index * self.bucket, now)
+        end = (index + 1) * self.bucket
+        for candidate in self._buckets[busiest]:
+            earliest = self._slots[candidate][0]
+            if earliest < end:
+                self.release(candidate)
+                at = max(earliest, start) + random.random() * (end - max(earliest, start))
+                self._add(candidate, earliest, at)
+                return candidate, at
+        return None
+
+    def report(self, start: float, end: float) -> PlanReport:
+        """Насколько ровно распределены подъёмы, запланированные на [`start`, `end`)."""
+        first = self._index(start)
+        last = max(first, self._index(end) - 1)
+        return PlanReport([self._load(i) for i in range(first, last + 1)], self.bucket)
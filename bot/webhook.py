@@ -0,0 +1,84 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+from aiohttp import web
+
+log = logging.getLogger('hh-update-bot')
+
+Message = Dict[str, Any]
+
+
+class WebhookServer:
+    """Приём обновлений Telegram через вебхук вместо long polling.
+
+    Сообщения раскладываются по `consumers` ограниченным очередям по идентификатору чата, и каждую
+    очередь разбирает свой обработчик: сообщения одного чата обрабатываются строго по порядку,
+    разных чатов — параллельно. Telegram получает ответ сразу после постановки в очередь;
+    если очередь переполнена, отвечаем 429, и Telegram повторит доставку позже."""
+
+    path: str
+
+    def __init__(
+            self,
+            handler: Callable[[Message], Awaitable[Any]],
+            path: str,
+            consumers: int = 8,
+            queue_size: int = 1000
+    ):
+        self.path = path
+        self._handler = handler
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=queue_size) for _ in range(consumers)]
+        self._consumers: List[asyncio.Future] = []
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.on_update)
+
+    async def on_update(self, request: web.Request) -> web.Response:
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        # only private chat messages are handled, just like in polling mode
+        message = update.get('message')
+        if not message or 'chat' not in message:
+            return web.Response()
+
+        queue = self._queues[message['chat']['id'] % len(self._queues)]
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            log.warning(f'Webhook: queue is full, asking Telegram to retry update {update.get("update_id")}')
+            return web.Response(status=429)
+        return web.Response()
+
+    async def _consume(self, queue: asyncio.Queue) -> None:
+        while True:
+            message = await queue.get()
+            try:
+                await self._handler(message)
+            except Exception:
+                log.exception('Webhook: error handling message')
+            finally:
+                queue.task_done()
+
+    async def start(self, host: str, port: int) -> None:
+        """Запустить обработчики очередей и HTTP-сервер."""
+        self._consumers = [asyncio.ensure_future(self._consume(queue)) for queue in self._queues]
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        log.info(f'Webhook: listening on {host}:{port}{self.path}')
+
+    async def join(self) -> None:
+        """Дождаться, пока будут обработаны все принятые сообщения."""
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+    async def stop(self) -> None:
+        """Остановить HTTP-сервер, обработать уже принятые сообщения и остановить обработчики."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+        await self.join()
+        for consumer in self._consumers:
+            consumer.cancel()
@@ -0,0 +1,25 @@
+import unittest
+
+
+class FakeClock:
+    """Часы для тестов: время идёт, только когда его двигают вручную."""
+
+    now: float
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class ClockTestCase(unittest.TestCase):
+    """Тест с часами `self.clock`, которые передаются проверяемому объекту вместо time.monotonic."""
+
+    clock: FakeClock
+
+    def setUp(self):
+        self.clock = FakeClock()
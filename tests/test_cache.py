@@ -0,0 +1,59 @@
+import unittest
+from bot.cache import TTLCache
+from tests.clock import ClockTestCase
+
+
+class TTLCacheTest(ClockTestCase):
+    """Устаревание записей по TTL, вытеснение по LRU и счётчики попаданий."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache: TTLCache[str, int] = TTLCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_entry_expires_after_ttl(self):
+        self.cache.put('a', 1)
+        self.clock.advance(10)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.clock.advance(0.001)
+        self.assertIsNone(self.cache.get('a'))
+        # an expired entry is dropped on access
+        self.assertEqual(len(self.cache), 0)
+
+    def test_put_restarts_ttl(self):
+        self.cache.put('a', 1)
+        self.clock.advance(8)
+        self.cache.put('a', 2)
+        self.clock.advance(8)
+        self.assertEqual(self.cache.get('a'), 2)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        # reading 'a' makes 'b' the least recently used entry
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.put('c', 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_invalidate_and_clear(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.invalidate('a')
+        self.cache.invalidate('missing')
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_hit_ratio(self):
+        self.cache.put('a', 1)
+        self.cache.get('a')
+        self.cache.get('a')
+        self.cache.get('b')
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+        self.assertEqual(str(self.cache), 'size=1, hits=2, misses=1, hit_ratio=0.67')
+
+
+if __name__ == '__main__':
+    unittest.main()
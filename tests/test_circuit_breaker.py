@@ -0,0 +1,77 @@
+import unittest
+from bot.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from tests.clock import ClockTestCase
+
+
+class CircuitBreakerTest(ClockTestCase):
+    """Переходы closed → open → half-open → closed и счётчики выключателя."""
+
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=30, clock=self.clock)
+
+    def trip(self) -> None:
+        for _ in range(self.breaker.failure_threshold):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.on_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.on_failure()
+        self.breaker.on_failure()
+        # a success resets the streak
+        self.breaker.on_success()
+        self.breaker.on_failure()
+        self.breaker.on_failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+        self.breaker.on_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertTrue(self.breaker.is_open)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.stats.opened, 1)
+        self.assertEqual(self.breaker.stats.rejected, 1)
+
+    def test_retry_after_counts_down(self):
+        self.trip()
+        self.assertEqual(self.breaker.retry_after, 30)
+        self.clock.advance(20)
+        self.assertEqual(self.breaker.retry_after, 10)
+        self.clock.advance(10)
+        self.assertEqual(self.breaker.retry_after, 0)
+
+    def test_half_open_lets_one_trial_through(self):
+        self.trip()
+        self.clock.advance(30)
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.is_open)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.on_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_opens_again(self):
+        self.trip()
+        self.clock.advance(30)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.on_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.stats.opened, 2)
+        # the reset timeout starts over
+        self.clock.advance(29)
+        self.assertFalse(self.breaker.allow())
+        self.clock.advance(1)
+        self.assertTrue(self.breaker.allow())
+
+    def test_cancelled_trial_frees_its_slot(self):
+        self.trip()
+        self.clock.advance(30)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.on_cancel()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+import unittest
+import dateutil.parser
+from bot.decoding import parse_timestamp
+
+msk = timezone(timedelta(hours=3))
+
+
+class ParseTimestampTest(unittest.TestCase):
+    """Быстрый разбор времени hh.ru и откат на dateutil для остальных форматов."""
+
+    def test_offset_without_colon(self):
+        parsed = parse_timestamp('2018-07-20T12:34:56+0300')
+        self.assertEqual(parsed, datetime(2018, 7, 20, 12, 34, 56, tzinfo=msk))
+        self.assertEqual(parsed.utcoffset(), timedelta(hours=3))
+
+    def test_offset_with_colon(self):
+        parsed = parse_timestamp('2018-07-20T12:34:56+03:00')
+        self.assertEqual(parsed, datetime(2018, 7, 20, 12, 34, 56, tzinfo=msk))
+        self.assertEqual(parsed.utcoffset(), timedelta(hours=3))
+
+    def test_negative_offset(self):
+        parsed = parse_timestamp('2018-07-20T12:34:56-0130')
+        self.assertEqual(parsed.utcoffset(), -timedelta(hours=1, minutes=30))
+
+    def test_other_formats_fall_back_to_dateutil(self):
+        for value in (
+                '2018-07-20T12:34:56Z',
+                '2018-07-20T12:34:56.123+0300',
+                '2018-07-20 12:34:56+0300',
+                '2018-07-20T12:34:56+03',
+        ):
+            with self.subTest(value=value):
+                self.assertEqual(parse_timestamp(value), dateutil.parser.parse(value))
+
+    def test_invalid_date_falls_back_to_dateutil(self):
+        with self.assertRaises(ValueError):
+            parse_timestamp('2018-02-30T12:34:56+0300')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+from bot.rate_limiter import RateLimiter, TokenBucket
+from tests.clock import ClockTestCase
+
+
+class TokenBucketTest(ClockTestCase):
+    """Ведро токенов: всплеск, очередь резервирований и пополнение."""
+
+    def test_burst_then_queue(self):
+        bucket = TokenBucket(rate=2, capacity=3, clock=self.clock)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.0])
+        # reservations beyond the burst queue up at 1 / rate apart
+        self.assertAlmostEqual(bucket.reserve(), 0.5)
+        self.assertAlmostEqual(bucket.reserve(), 1.0)
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(rate=2, capacity=3, clock=self.clock)
+        for _ in range(3):
+            bucket.reserve()
+        self.clock.advance(60)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(bucket.reserve(), 0.5)
+
+    def test_set_rate_keeps_tokens_earned_at_old_rate(self):
+        bucket = TokenBucket(rate=1, capacity=1, clock=self.clock)
+        bucket.reserve()
+        self.clock.advance(0.5)
+        bucket.set_rate(4)
+        # half a token was earned at the old rate, the other half takes 1/8 s at the new one
+        self.assertAlmostEqual(bucket.reserve(), 0.125)
+
+
+class RateLimiterTest(ClockTestCase):
+    """AIMD-подстройка глобальной частоты, пауза по Retry-After и бюджеты токенов и методов."""
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def acquire(self, limiter: RateLimiter, token: str = 'token', endpoint: str = 'resume') -> float:
+        return self.loop.run_until_complete(limiter.acquire(token, endpoint))
+
+    def test_multiplicative_decrease_once_per_interval(self):
+        limiter = RateLimiter(global_rate=16, token_rate=100, min_rate=3, backoff_interval=1, clock=self.clock)
+        limiter.on_throttle()
+        self.assertEqual(limiter.global_rate, 8)
+        # a burst of 429s within the interval backs off only once
+        limiter.on_throttle()
+        self.assertEqual(limiter.global_rate, 8)
+        self.clock.advance(1)
+        limiter.on_throttle()
+        self.assertEqual(limiter.global_rate, 4)
+        self.clock.advance(1)
+        limiter.on_throttle()
+        self.assertEqual(limiter.global_rate, 3)
+        self.assertEqual(limiter.stats.throttled, 4)
+        self.assertEqual(limiter.stats.backoffs, 3)
+
+    def test_additive_increase_up_to_max(self):
+        limiter = RateLimiter(global_rate=10, token_rate=100, increase=1, clock=self.clock)
+        limiter.on_throttle()
+        for _ in range(3):
+            limiter.on_success()
+        self.assertEqual(limiter.global_rate, 8)
+        for _ in range(10):
+            limiter.on_success()
+        self.assertEqual(limiter.global_rate, 10)
+
+    def test_retry_after_pauses_all_requests(self):
+        limiter = RateLimiter(global_rate=100, token_rate=100, clock=self.clock)
+        limiter.on_throttle(retry_after=0.05)
+        self.assertAlmostEqual(self.acquire(limiter, token='other'), 0.05)
+        self.clock.advance(0.05)
+        self.assertEqual(self.acquire(limiter, token='other'), 0.0)
+
+    def test_token_and_endpoint_budgets(self):
+        limiter = RateLimiter(global_rate=1000, token_rate=20, endpoint_rates={'publish': 10}, clock=self.clock)
+        for _ in range(20):
+            self.acquire(limiter, token='a')
+        # the same token waits for its own bucket, another token doesn't
+        self.assertAlmostEqual(self.acquire(limiter, token='a'), 0.05)
+        self.assertEqual(self.acquire(limiter, token='b'), 0.0)
+
+        for _ in range(10):
+            self.acquire(limiter, token='c', endpoint='publish')
+        self.assertAlmostEqual(self.acquire(limiter, token='d', endpoint='publish'), 0.1)
+        self.assertEqual(limiter.stats.delayed, 2)
+
+    def test_least_recently_used_token_is_forgotten(self):
+        limiter = RateLimiter(global_rate=1000, token_rate=1, max_tokens=2, clock=self.clock)
+        self.acquire(limiter, token='a')
+        self.acquire(limiter, token='b')
+        self.acquire(limiter, token='c')
+        # 'a' was evicted, so it starts with a full bucket again
+        self.assertEqual(self.acquire(limiter, token='a'), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+from typing import Any, List, Sequence, Tuple
+import asyncio
+import unittest
+from unittest import mock
+import bot.repository
+from bot.repository import Statement, row_factory
+
+
+class Resume:
+    def __init__(self, resume_id: str, title: str, user_id: int = None):
+        self.resume_id = resume_id
+        self.title = title
+        self.user_id = user_id
+
+
+class FakeConnection:
+    pass
+
+
+class FakeCursor:
+    """Курсор aiopg, который запоминает выполненные запросы и отдаёт заранее заданные строки."""
+
+    def __init__(self, connection: FakeConnection, columns: Sequence[str] = (), rows: List[tuple] = None):
+        self.connection = connection
+        self.description = [(column,) for column in columns]
+        self.rows = rows or []
+        self.executed: List[Tuple[str, Any]] = []
+
+    async def execute(self, sql: str, params: Any = None) -> None:
+        self.executed.append((sql, params))
+
+    async def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    async def fetchall(self):
+        return self.rows
+
+
+class StatementTest(unittest.TestCase):
+    """Текст PREPARE/EXECUTE и порядок позиционных параметров."""
+
+    sql = '''
+        UPDATE resume SET title=%(title)s, next_publish_at=%(next_publish_at)s
+        WHERE resume_id=%(resume_id)s AND (title IS DISTINCT FROM %(title)s);
+    '''
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.connection = FakeConnection()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def execute(self, statement: Statement, cur: FakeCursor, params: dict = None) -> None:
+        self.loop.run_until_complete(statement.execute(cur, params))
+
+    def test_repeated_parameter_gets_one_position(self):
+        statement = Statement('test_repeated', self.sql)
+        cur = FakeCursor(self.connection)
+        self.execute(statement, cur, {'resume_id': 'r1', 'title': 'Python', 'next_publish_at': 42, 'unused': 0})
+
+        prepare, execute = cur.executed
+        self.assertEqual(prepare, (
+            'PREPARE test_repeated AS UPDATE resume SET title=$1, next_publish_at=$2\n'
+            '        WHERE resume_id=$3 AND (title IS DISTINCT FROM $1);',
+            None
+        ))
+        # values follow the order in which parameters first appear in the text
+        self.assertEqual(execute, ('EXECUTE test_repeated (%s, %s, %s);', ['Python', 42, 'r1']))
+
+    def test_prepared_once_per_connection(self):
+        statement = Statement('test_once', 'SELECT %(a)s')
+        cur = FakeCursor(self.connection)
+        self.execute(statement, cur, {'a': 1})
+        self.execute(statement, cur, {'a': 2})
+        self.assertEqual([sql for sql, _ in cur.executed],
+                         ['PREPARE test_once AS SELECT $1;', 'EXECUTE test_once (%s);', 'EXECUTE test_once (%s);'])
+
+        other = FakeCursor(FakeConnection())
+        self.execute(statement, other, {'a': 3})
+        self.assertEqual(other.executed[0][0], 'PREPARE test_once AS SELECT $1;')
+
+    def test_without_parameters(self):
+        statement = Statement('test_plain', 'SELECT 1;')
+        cur = FakeCursor(self.connection)
+        self.execute(statement, cur)
+        self.assertEqual(cur.executed, [('PREPARE test_plain AS SELECT 1;', None), ('EXECUTE test_plain;', [])])
+
+    def test_disabled_runs_text_as_is(self):
+        statement = Statement('test_disabled', self.sql)
+        cur = FakeCursor(self.connection)
+        params = {'resume_id': 'r1', 'title': 'Python', 'next_publish_at': 42}
+        with mock.patch.object(bot.repository, 'prepare_statements', False):
+            self.execute(statement, cur, params)
+        self.assertEqual(cur.executed, [(self.sql, params)])
+
+    def test_fetch_maps_description_to_model(self):
+        statement = Statement('test_fetch', 'SELECT title, resume_id FROM resume WHERE user_id=%(user_id)s')
+        cur = FakeCursor(self.connection, columns=['title', 'resume_id'], rows=[('Python', 'r1'), ('Go', 'r2')])
+
+        resumes = self.loop.run_until_complete(statement.fetch_all(cur, Resume, {'user_id': 7}))
+        self.assertEqual([(r.resume_id, r.title, r.user_id) for r in resumes], [('r1', 'Python', None), ('r2', 'Go', None)])
+
+        resume = self.loop.run_until_complete(statement.fetch_one(cur, Resume, {'user_id': 7}))
+        self.assertEqual((resume.resume_id, resume.title), ('r1', 'Python'))
+
+        cur.rows = []
+        self.assertIsNone(self.loop.run_until_complete(statement.fetch_one(cur, Resume, {'user_id': 7})))
+        self.assertEqual(self.loop.run_until_complete(statement.fetch_all(cur, Resume, {'user_id': 7})), [])
+
+
+class RowFactoryTest(unittest.TestCase):
+    """Сборка объектов модели из строк по списку столбцов."""
+
+    def test_columns_passed_by_name(self):
+        factory = row_factory(Resume, ['user_id', 'title', 'resume_id'])
+        resume = factory((7, 'Python', 'r1'))
+        self.assertEqual((resume.resume_id, resume.title, resume.user_id), ('r1', 'Python', 7))
+
+    def test_factory_reused_for_same_columns(self):
+        self.assertIs(row_factory(Resume, ['resume_id', 'title']), row_factory(Resume, ('resume_id', 'title')))
+        self.assertIsNot(row_factory(Resume, ['resume_id', 'title']), row_factory(Resume, ['title', 'resume_id']))
+
+    def test_invalid_column_name(self):
+        with self.assertRaises(ValueError):
+            row_factory(Resume, ['resume_id', 'count(*)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
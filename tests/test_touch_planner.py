@@ -0,0 +1,98 @@
+from typing import Dict, List
+import random
+import unittest
+from bot.touch_planner import PlanReport, TouchPlanner
+
+
+class TouchPlannerTest(unittest.TestCase):
+    """Планировщик подъёмов: границы задержки, выбор корзины и ровность нагрузки по циклам."""
+
+    def setUp(self):
+        random.seed(1)
+
+    def test_slot_is_within_max_delay(self):
+        planner = TouchPlanner(bucket=10, max_delay=600)
+        earliest = {f'r{n}': random.gauss(1000, 60) for n in range(3000)}
+        for resume_id, at in planner.plan_many(earliest.items()).items():
+            self.assertGreaterEqual(at, earliest[resume_id])
+            self.assertLessEqual(at, earliest[resume_id] + 600)
+
+        # planned one by one, the last buckets of the window are the least loaded ones
+        planner = TouchPlanner(bucket=10, max_delay=600)
+        for resume_id, at in earliest.items():
+            slot = planner.plan(resume_id, at)
+            self.assertGreaterEqual(slot, at)
+            self.assertLessEqual(slot, at + 600)
+
+    def test_no_delay_without_max_delay(self):
+        planner = TouchPlanner(bucket=10, max_delay=0)
+        self.assertEqual(planner.plan('a', 1005.0), 1005.0)
+        self.assertEqual(planner.plan('b', 1005.0), 1005.0)
+
+    def test_least_loaded_bucket_earliest_first(self):
+        planner = TouchPlanner(bucket=10, max_delay=30)
+        self.assertLess(planner.plan('a', 1000.0), 1010)
+        # the first bucket is taken, the next three are equally empty
+        self.assertTrue(1010 <= planner.plan('b', 1000.0) < 1020)
+        self.assertTrue(1020 <= planner.plan('c', 1000.0) < 1030)
+
+    def test_release_and_replan(self):
+        planner = TouchPlanner(bucket=10, max_delay=30)
+        planner.plan('a', 1000.0)
+        planner.plan('a', 1000.0)
+        self.assertEqual(len(planner), 1)
+        self.assertEqual(planner.report(1000, 1040).planned, 1)
+
+        self.assertIsNotNone(planner.release('a'))
+        self.assertIsNone(planner.release('a'))
+        self.assertIsNone(planner.slot('a'))
+        self.assertEqual(planner.report(1000, 1040).planned, 0)
+
+    def test_remove_fills_freed_bucket_from_busier_one(self):
+        planner = TouchPlanner(bucket=10, max_delay=30)
+        planner._add('a', 1000.0, 1005.0)
+        for resume_id in ('b', 'c', 'd'):
+            planner._add(resume_id, 1000.0, 1025.0)
+
+        moved = planner.remove('a', now=1000.0)
+        self.assertIsNotNone(moved)
+        resume_id, at = moved
+        self.assertIn(resume_id, ('b', 'c', 'd'))
+        self.assertTrue(1000 <= at < 1010)
+        self.assertEqual(planner.slot(resume_id), at)
+
+        # past buckets are not filled
+        self.assertIsNone(planner.remove(resume_id, now=1020.0))
+
+    def test_spread_does_not_regress_over_cycles(self):
+        cooldown = 4 * 60 * 60
+        earliest: Dict[str, float] = {f'r{n}': random.gauss(0, 300) for n in range(5000)}
+        unplanned = self._report(TouchPlanner(bucket=10, max_delay=0), earliest)
+
+        planner = TouchPlanner(bucket=10, max_delay=600)
+        reports: List[PlanReport] = []
+        delays: List[float] = []
+        for _ in range(4):
+            slots = planner.plan_many(earliest.items())
+            delays.extend(slots[resume_id] - at for resume_id, at in earliest.items())
+            reports.append(planner.report(min(slots.values()), max(slots.values()) + planner.bucket))
+            for resume_id, at in slots.items():
+                planner.release(resume_id)
+                earliest[resume_id] = at + cooldown
+
+        self.assertLess(reports[0].peak_rate, unplanned.peak_rate * 0.7)
+        for previous, report in zip(reports, reports[1:]):
+            # once spread, resumes stay spread: the peak never grows back
+            self.assertLessEqual(report.peak_rate, previous.peak_rate * 1.05)
+            self.assertLessEqual(report.peak_to_mean, reports[0].peak_to_mean * 1.1)
+        self.assertLessEqual(max(delays), 600)
+        self.assertLess(sum(delays) / len(delays), 200)
+
+    @staticmethod
+    def _report(planner: TouchPlanner, earliest: Dict[str, float]) -> PlanReport:
+        slots = planner.plan_many(earliest.items())
+        return planner.report(min(slots.values()), max(slots.values()) + planner.bucket)
+
+
+if __name__ == '__main__':
+    unittest.main()